@@ -1,5 +1,5 @@
 import os
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_cors import CORS
 from .config import Config
 
@@ -7,17 +7,38 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
-    CORS(app)
+    CORS(app, expose_headers=["ETag", "X-Total-Count", "Upload-Offset", "Location"])
+
+    # Storage and job submission are configured explicitly so the pipeline
+    # never needs an app context (executor threads / standalone workers).
+    from app.services import storage, procs, state, retention
+    from app.workers import runner
+    from app.pipelines import stream_windows
+    from app.sse import broker, server as sse_server
+    storage.configure(app.config)
+    procs.configure(app.config)
+    state.configure(app.config)
+    stream_windows.configure(app.config)
+    broker.configure(app.config)
+    broker.set_recorder(storage.record_event)
+    if app.config["SSE_PORT"]:
+        sse_server.start(app.config)
+    if app.config["JOB_BACKEND"] == "thread":
+        retention.start(app.config)  # GC runs where the jobs run
+    runner.configure(app.config)
 
     # Blueprints
-    from app.api import videos, windows, health
+    from app.api import videos, windows, health, events, uploads
     app.register_blueprint(videos.bp, url_prefix="/videos")
+    app.register_blueprint(uploads.bp, url_prefix="/uploads")
     app.register_blueprint(windows.bp, url_prefix="/")
     app.register_blueprint(health.bp, url_prefix="/")
+    app.register_blueprint(events.bp, url_prefix="/")
 
-    # Dev-only media serving (use nginx in prod)
+    # Dev-only media serving (use nginx in prod); redirects to presigned
+    # URLs when artifacts live in an S3-compatible store
     @app.route("/media/<path:filename>")
     def media(filename):
-        return send_from_directory(app.config["MEDIA_ROOT"], filename)
+        return storage.media_response(filename)
 
     return app
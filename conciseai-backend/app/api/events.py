@@ -0,0 +1,33 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.sse import broker, dashboard
+
+bp = Blueprint("events", __name__)
+
+def _csv(name):
+    v = request.args.get(name, "")
+    return [x for x in v.split(",") if x] or None
+
+@bp.get("/events")
+def firehose():
+    """
+    Every video's events as {"video_id", "event_id", "event"} frames.
+    ?video=a,b  only these videos;  ?type=window_done,video_done  only these types
+    Resuming works against the same process only; elsewhere (another
+    worker, after a restart) the stream starts with a resync event.
+    """
+    match = broker.firehose_filter(_csv("video"), _csv("type"))
+    last = request.headers.get("Last-Event-ID") or request.args.get("last_event_id", "")
+    sub = broker.subscribe(broker.FIREHOSE, last_event_id=last or None,
+                           replay=bool(last), heartbeat=broker.HEARTBEAT_SECONDS)
+    def stream():
+        yield ": connected\n\n"  # live-only streams may stay quiet; flush headers now
+        for item in sub:
+            if item is None:
+                yield ": ping\n\n"
+            elif item[0] is None or not match or match(item[1]):
+                yield broker.frame(broker.firehose_id(item[0]), item[1])
+    return Response(stream_with_context(stream()), mimetype="text/event-stream")
+
+@bp.get("/dashboard")
+def snapshot():
+    return jsonify(dashboard.snapshot())
@@ -1,6 +1,13 @@
 from flask import Blueprint, jsonify
+from app.services import procs, storage, retention
+from app.workers import runner
+from app.sse import broker
 bp = Blueprint("health", __name__)
 
 @bp.get("/health")
 def health():
     return jsonify({"ok": True})
+
+@bp.get("/metrics")
+def metrics():
+    return jsonify({"procs": procs.stats(), "scheduler": runner.stats(), "state_cache": storage.cache_stats(), "retention": retention.stats(), "sse": broker.stats()})
@@ -0,0 +1,167 @@
+"""
+Resumable uploads for large files:
+
+    POST   /uploads                 {"filename", "size"?}   -> 201 {"id", "offset": 0, ...}
+    PUT    /uploads/<id>            body = bytes at Content-Range "bytes <start>-<end>/<total|*>"
+                                    (or an Upload-Offset header)          -> {"offset"}
+    HEAD   /uploads/<id>            Upload-Offset header (GET: JSON)      -> resume point
+    POST   /uploads/<id>/complete   {"sha256"?}                           -> 201 like POST /videos
+
+A chunk that doesn't start at the current offset gets 409 with the offset
+to resume from. The body is streamed straight into the master file; one
+whose first bytes aren't a known video container gets 415.
+
+Streamable containers (MKV, fragmented MP4) uploaded with a declared size
+start processing once INGEST_MIN_BYTES have arrived: the video is
+"ingesting" and windows run once all their packets have landed; complete
+then only settles the duration and checksum. A finished file that isn't a
+video still gets 415 there: the session is "rejected" and the video fails.
+"""
+
+import re, shutil, subprocess
+from flask import Blueprint, request, jsonify, current_app
+from app.services import storage, uploads, mediaio
+from app.utils.errors import UploadConflict, UnsupportedMedia
+from app.api.videos import _allowed, _probe_header, start_job
+from app.workers.runner import submit_stream_job
+from app.sse.broker import publish
+
+bp = Blueprint("uploads", __name__)
+
+_RANGE = re.compile(r"bytes (\d+)-\d+/(?:\d+|\*)$")
+
+def _view(s):
+    return {"id": s["id"], "filename": s["filename"], "size": s["size"], "offset": s["offset"], "status": s["status"]}
+
+def _conflict(e):
+    resp = jsonify({"error": str(e), "offset": e.offset})
+    resp.headers["Upload-Offset"] = str(e.offset)
+    return resp, 409
+
+@bp.post("")
+def create_upload():
+    body = request.get_json(silent=True) or {}
+    filename, size = body.get("filename") or "", body.get("size")
+    if not filename:
+        return jsonify({"error":"filename required"}), 400
+    if not _allowed(filename, current_app.config["ALLOWED_EXTENSIONS"]):
+        return jsonify({"error":"unsupported file type"}), 400
+    if size is not None and (not isinstance(size, int) or not 0 < size <= current_app.config["UPLOAD_MAX_BYTES"]):
+        return jsonify({"error":"invalid size"}), 400
+    s = uploads.create(filename, size)
+    resp = jsonify(_view(s))
+    resp.headers["Location"] = f"/uploads/{s['id']}"
+    return resp, 201
+
+@bp.route("/<video_id>", methods=["GET", "HEAD"])
+def upload_status(video_id):
+    s = uploads.get(video_id)
+    if not s:
+        return jsonify({"error":"not found"}), 404
+    resp = jsonify(_view(s))
+    resp.headers["Upload-Offset"] = str(s["offset"])
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+@bp.put("/<video_id>")
+def put_chunk(video_id):
+    m = _RANGE.match(request.headers.get("Content-Range", ""))
+    offset = request.headers.get("Upload-Offset", "")
+    if m:
+        offset = int(m.group(1))
+    elif offset.isdigit():
+        offset = int(offset)
+    else:
+        return jsonify({"error":"Content-Range or Upload-Offset required"}), 400
+    try:
+        # request.stream: read as it arrives, never spooled by Werkzeug
+        end = uploads.write(video_id, offset, request.stream, current_app.config["UPLOAD_MAX_BYTES"])
+    except KeyError:
+        return jsonify({"error":"not found"}), 404
+    except UploadConflict as e:
+        return _conflict(e)
+    except UnsupportedMedia as e:
+        return jsonify({"error": str(e)}), 415
+    _maybe_ingest(video_id, end)
+    resp = jsonify({"id": video_id, "offset": end})
+    resp.headers["Upload-Offset"] = str(end)
+    return resp
+
+def _maybe_ingest(video_id, end):
+    cfg = current_app.config
+    if not cfg["INGEST_WHILE_UPLOADING"] or end < cfg["INGEST_MIN_BYTES"]:
+        return
+    s = uploads.get(video_id)
+    # Without a declared size there is no telling when the file is whole
+    if s["size"] is None or s.get("ingest") or s["status"] != "uploading":
+        return
+    if not mediaio.sniff_streamable(s["master_path"]):
+        return
+    try:
+        mediaio.probe_duration_sec(s["master_path"])
+    except (subprocess.CalledProcessError, KeyError, ValueError):
+        return  # not enough to read a duration yet
+    try:
+        # Marked only once the job is submitted: complete_upload goes by the mark
+        uploads.mark_ingest(video_id, then=lambda s: start_job(video_id, s["filename"], s["master_path"], ingest=True))
+    except Exception:
+        # The chunk itself is stored; try again with the next one, or start at complete
+        current_app.logger.exception("early start of %s failed", video_id)
+
+@bp.post("/<video_id>/complete")
+def complete_upload(video_id):
+    s = uploads.get(video_id)
+    if not s:
+        return jsonify({"error":"not found"}), 404
+    if s["status"] == "complete":
+        # Retried finalize: the job already exists
+        v = _resume_stalled(video_id) or {}
+        return jsonify({"id": video_id, "status": v.get("status"), "window_seconds": v.get("window_seconds")}), 200
+    if s["status"] == "rejected":
+        return jsonify({"error": s["error"]}), 415
+    body = request.get_json(silent=True) or {}
+    started = {}
+
+    def start(s, sha256):
+        if s.get("ingest"):
+            # Already processing; the job picks up the final duration itself,
+            # but the whole file gets the same check as any other upload
+            _probe_header(s["master_path"])
+            storage.publish_artifacts([s["master_path"]])
+            return
+        started["state"] = start_job(video_id, s["filename"], s["master_path"], sha256=sha256,
+                                     size_bytes=s["offset"], container=s.get("container"))
+
+    try:
+        # The session only turns "complete" once the job has started
+        _, sha256, _ = uploads.finalize(video_id, body.get("sha256"), then=start)
+    except UploadConflict as e:
+        return _conflict(e)
+    except UnsupportedMedia as e:
+        # Not a video: no retry can help, so don't keep the bytes around.
+        # An ingest job owns its directory; it fails the video instead
+        if uploads.get(video_id).get("ingest"):
+            uploads.reject(video_id, str(e))
+        else:
+            shutil.rmtree(storage.video_dir(video_id), ignore_errors=True)
+        return jsonify({"error": str(e)}), 415
+    state = started.get("state") or _resume_stalled(video_id) or {}
+    return jsonify({"id": video_id, "status": state.get("status"), "window_seconds": state.get("window_seconds"),
+                    "sha256": sha256}), 201 if "state" in started else 200
+
+def _resume_stalled(video_id):
+    """
+    The video's current state; if ingest gave up on the upload before it
+    completed (status "stalled"), first resubmit the job for the rest. The
+    session lock settles a race with the job's own finish().
+    """
+    with uploads.locked(video_id) as s:
+        v = storage.read_video_state(video_id)
+        if not v or v.get("status") != "stalled":
+            return v
+        v = {k: x for k, x in v.items() if k != "ingest_stalled"}
+        v["status"] = "ingesting"
+        storage.write_video_state(v)
+    publish(video_id, {"type": "video_started", "id": video_id, "duration_sec": v["duration_sec"], "status": "ingesting"})
+    submit_stream_job(video_id, s["master_path"], ingest=True)
+    return v
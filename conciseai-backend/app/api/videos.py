@@ -1,7 +1,9 @@
-import os
+import os, shutil, subprocess
 from flask import Blueprint, request, jsonify, current_app
-from werkzeug.utils import secure_filename
-from app.services import storage, mediaio
+from werkzeug.formparser import default_stream_factory, parse_form_data
+from app.services import storage, mediaio, procs, uploads
+from app.utils.errors import UnsupportedMedia
+from app.workers import queue
 from app.workers.runner import submit_stream_job
 from app.sse.broker import publish
 
@@ -13,23 +15,112 @@ def _allowed(filename, allowed):
 
 @bp.post("")
 def upload_video():
-    f = request.files.get("file")
-    if not f or f.filename == "":
-        return jsonify({"error":"file required"}), 400
-    if not _allowed(f.filename, current_app.config["ALLOWED_EXTENSIONS"]):
-        return jsonify({"error":"unsupported file type"}), 400
-
+    allowed = current_app.config["ALLOWED_EXTENSIONS"]
     vid = storage.new_id("v")
     vdir = storage.video_dir(vid)
-    os.makedirs(vdir, exist_ok=True)
-    master_path = os.path.join(vdir, "master." + f.filename.rsplit(".",1)[-1].lower())
-    f.save(master_path)
+    receivers = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        # The first video part is written straight into the master (hashed
+        # and sniffed on the way) instead of spooled to a temp file and copied
+        if receivers or not filename or not _allowed(filename, allowed):
+            return default_stream_factory(total_content_length, content_type, filename, content_length)
+        os.makedirs(vdir, exist_ok=True)
+        receivers.append(uploads.Receiver(os.path.join(vdir, "master." + filename.rsplit(".", 1)[-1].lower())))
+        return receivers[0]
+
+    state = None
+    try:
+        try:
+            _, _, files = parse_form_data(request.environ, stream_factory=stream_factory,
+                                          max_content_length=current_app.config["MAX_CONTENT_LENGTH"], silent=False)
+        except ValueError:  # truncated or otherwise broken multipart body
+            return jsonify({"error":"malformed upload"}), 400
+        f = files.get("file")
+        if not f or f.filename == "":
+            return jsonify({"error":"file required"}), 400
+        if not receivers or f.stream is not receivers[0]:
+            return jsonify({"error":"unsupported file type"}), 400
+        sha256, size, container = receivers[0].finish()
+        state = start_job(vid, f.filename, receivers[0].path, sha256=sha256, size_bytes=size, container=container)
+    except UnsupportedMedia as e:
+        return jsonify({"error": str(e)}), 415
+    finally:
+        # Whatever went wrong (a 4xx above, a disconnect, a body over the
+        # limit), no job owns the master: drop it with its directory
+        if state is None and receivers:
+            receivers[0].close()
+            shutil.rmtree(vdir, ignore_errors=True)
+    return jsonify({"id": vid, "status": state["status"], "window_seconds": state["window_seconds"]}), 201
 
+def start_job(vid, filename, master_path, ingest=False, **extra):
+    """
+    Probe the master's headers, create video.json (plus `extra`) and submit
+    the job. Streams, fps and audio presence are kept in video.json under
+    "media" for later stages; the keyframe index needs a pass over every
+    packet, so the worker builds it behind the video's windows. With
+    `ingest` the master is still uploading: the video starts out
+    "ingesting" with the duration of what has arrived, and is probed in
+    full once complete.
+    Raises UnsupportedMedia if the file can't be read as a video.
+    """
     # Probe duration & init state
-    duration = mediaio.probe_duration_sec(master_path)
-    state = storage.init_video_state(vid, f.filename, duration, current_app.config["WINDOW_SECONDS"])
-    publish(vid, {"type":"video_started","id":vid,"duration_sec":duration})
+    if ingest:
+        try:
+            duration = mediaio.probe_duration_sec(master_path)
+        except (subprocess.CalledProcessError, KeyError, ValueError):
+            raise UnsupportedMedia("unreadable video")
+    else:
+        extra["media"] = _probe_header(master_path)
+        duration = int(extra["media"]["duration_sec"])
+        # Only once it checks out: a rejected file leaves nothing in the blob store
+        storage.publish_artifacts([master_path])  # multipart upload for remote stores
+    cfg = current_app.config
+    if ingest:
+        extra["status"] = "ingesting"
+    state = storage.init_video_state(
+        vid, filename, duration, cfg["WINDOW_SECONDS"],
+        window_planner=cfg["WINDOW_PLANNER"], window_tolerance_sec=cfg["WINDOW_TOLERANCE_SECONDS"], **extra
+    )
+    publish(vid, {"type":"video_started","id":vid,"duration_sec":duration,"status":state["status"]})
 
     # Kick pipeline
-    submit_stream_job(vid, master_path)
-    return jsonify({"id": vid, "status": state["status"], "window_seconds": state["window_seconds"]}), 201
+    submit_stream_job(vid, master_path, ingest=ingest)
+    return state
+
+def _probe_header(master_path):
+    """mediaio.probe without the keyframe index; raises UnsupportedMedia unless it's a readable video."""
+    try:
+        media = mediaio.probe(master_path, keyframes=False)
+    except (subprocess.CalledProcessError, KeyError, ValueError):
+        raise UnsupportedMedia("unreadable video")
+    if media["video"] is None:
+        raise UnsupportedMedia("no video stream")
+    return media
+
+@bp.delete("/<video_id>/job")
+def cancel_job(video_id):
+    v = storage.read_video_state(video_id)
+    if not v:
+        return jsonify({"error":"not found"}), 404
+    if v["status"] not in storage.ACTIVE_STATUSES:
+        return jsonify({"error":"job not active", "status": v["status"]}), 409
+
+    running_here = procs.request_cancel(video_id)
+    if v["status"] == "queued" and not running_here:
+        v = dict(v)
+        # Not picked up yet: settle it now; a worker that races us sees the flag
+        dropped = queue.drop(video_id)
+        v["status"] = "cancelled"
+        storage.write_video_state(v)
+        if dropped:
+            procs.clear_cancel(video_id)  # no worker will ever see it
+        publish(video_id, {"type":"video_cancelled"})
+    else:
+        # The job may have settled while the flag was written; then nobody clears it
+        v = storage.read_video_state(video_id) or v
+        if v["status"] not in storage.ACTIVE_STATUSES:
+            procs.clear_cancel(video_id)
+            if v["status"] != "cancelled":
+                return jsonify({"error":"job not active", "status": v["status"]}), 409
+    return jsonify({"id": video_id, "status": "cancelled" if v["status"] == "cancelled" else "cancelling"}), 202
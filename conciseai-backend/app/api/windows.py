@@ -1,22 +1,103 @@
-from flask import Blueprint, Response, jsonify, stream_with_context
+import json
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.sse import broker
 from app.sse.broker import subscribe
-from app.services.storage import list_windows, read_json, video_json_path
+from app.services import storage
+from app.services.storage import read_video_state
 
 bp = Blueprint("windows", __name__)
+_sse = broker.frame
+
+def _last_event_id():
+    last = request.headers.get("Last-Event-ID") or request.args.get("last_event_id", "")
+    return int(last) if last.isdigit() else None
 
 @bp.get("/videos/<video_id>/events")
 def events(video_id):
+    if storage.backend() == "journal":
+        return _journal_events(video_id)
+    # Replays retained events after Last-Event-ID (or all retained ones on a
+    # first connect), then streams live
+    sub = subscribe(video_id, last_event_id=_last_event_id(), heartbeat=broker.HEARTBEAT_SECONDS)
+    def stream():
+        for item in sub:
+            yield _sse(*item) if item else ": ping\n\n"
+    return Response(stream_with_context(stream()), mimetype="text/event-stream")
+
+def _journal_events(video_id):
+    # Subscribe first, then replay the journal after Last-Event-ID, then go
+    # live skipping anything the replay already covered. The journal holds
+    # the full history, so the in-memory ring is not needed here.
+    from app.services import journal
+    last = _last_event_id()
+    live = subscribe(video_id, replay=False, heartbeat=broker.HEARTBEAT_SECONDS)
     def stream():
-        for msg in subscribe(video_id):
-            yield f"data: {msg}\n\n"
+        seen = last if last is not None else -1
+        for seq, payload in journal.events(video_id, last):
+            seen = seq
+            yield _sse(seq, json.dumps(payload))
+        for item in live:
+            if item is None:
+                yield ": ping\n\n"
+                continue
+            eid, msg = item
+            if eid is not None and eid <= seen:
+                continue
+            seen = eid
+            yield _sse(eid, msg)
     return Response(stream_with_context(stream()), mimetype="text/event-stream")
 
+def _conditional(video_id, make_body):
+    """
+    Weak-ETag'd JSON response keyed on the storage state version. The version
+    is taken before the body is built, so a racing write can only cause a
+    spare re-download, never a stale 304. Matching If-None-Match → 304
+    without touching the state documents.
+    """
+    storage.touch_access(video_id)
+    version = storage.state_version(video_id)
+    if version is not None and request.if_none_match.contains_weak(version):
+        resp = Response(status=304)
+    else:
+        body = make_body()
+        if body is None:
+            return jsonify({"error":"not found"}), 404
+        resp = jsonify(body)
+    if version is not None:
+        resp.set_etag(version, weak=True)
+    # Let browsers and shared caches keep a copy but revalidate every poll
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
 @bp.get("/videos/<video_id>")
 def video_state(video_id):
-    v = read_json(video_json_path(video_id))
-    if not v: return jsonify({"error":"not found"}), 404
-    return jsonify(v)
+    return _conditional(video_id, lambda: read_video_state(video_id) or None)
 
 @bp.get("/videos/<video_id>/windows")
 def windows(video_id):
-    return jsonify(list_windows(video_id))
+    """
+    ?offset=&limit=     page (limit <= 1000); X-Total-Count carries the match count
+    ?status=done,failed only windows in these statuses
+    ?since_version=N    only windows written after video version N
+    ?fields=status,summary_uri   sparse documents (index is always included)
+    """
+    args = request.args
+    try:
+        offset = int(args.get("offset", 0))
+        limit = int(args["limit"]) if "limit" in args else None
+        since = int(args["since_version"]) if "since_version" in args else None
+    except ValueError:
+        return jsonify({"error":"offset, limit and since_version must be integers"}), 400
+    if offset < 0 or (limit is not None and not 0 < limit <= 1000):
+        return jsonify({"error":"offset must be >= 0 and limit in 1..1000"}), 400
+    status = {s for s in args.get("status", "").split(",") if s} or None
+    fields = [f for f in args.get("fields", "").split(",") if f] or None
+
+    total = {}
+    def body():
+        total["n"], page = storage.query_windows(video_id, offset, limit, status, since, fields)
+        return page
+    resp = _conditional(video_id, body)
+    if "n" in total:
+        resp.headers["X-Total-Count"] = str(total["n"])
+    return resp
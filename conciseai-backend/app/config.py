@@ -2,9 +2,106 @@ import os
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 class Config:
-    MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+    MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(BASE_DIR, "media"))
     MEDIA_URL = "/media"
+    # "sharded" stores new videos under videos/ab/cd/<id>; "flat" under videos/<id>.
+    # Lookups find either; `python -m app.tools.shard_media` migrates flat → sharded.
+    MEDIA_LAYOUT = os.getenv("MEDIA_LAYOUT", "sharded")
     WINDOW_SECONDS = 600  # 10 minutes
+    # "content" snaps cuts to slide changes / silence within ±tolerance, "fixed" cuts every WINDOW_SECONDS
+    WINDOW_PLANNER = os.getenv("WINDOW_PLANNER", "content")
+    WINDOW_TOLERANCE_SECONDS = 60
     MAX_CONTENT_LENGTH = 2 * 1024 * 1024 * 1024  # 2GB
     ALLOWED_EXTENSIONS = {"mp4", "mov", "mkv"}
+    # Total size of a resumable upload (/uploads); each chunk is still
+    # bounded by MAX_CONTENT_LENGTH
+    UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024 * 1024)))
+    # An upload session that has no job yet and hasn't changed for this long
+    # is abandoned: retention may delete it to stay under DISK_QUOTA_BYTES
+    UPLOAD_SESSION_IDLE_SECONDS = 7 * 24 * 3600
+    # Process windows of streamable uploads (MKV, fragmented MP4) while the
+    # rest is still arriving, once this much is in
+    INGEST_WHILE_UPLOADING = os.getenv("INGEST_WHILE_UPLOADING", "1") == "1"
+    INGEST_MIN_BYTES = 16 * 1024 * 1024
+    INGEST_POLL_SECONDS = 5
+    # Stay this far behind the last fully arrived packet (frame reordering,
+    # decoder preroll when a window is cut)
+    INGEST_MARGIN_SECONDS = 2
+    # An ingesting upload that hasn't grown for this long is settled as is
+    INGEST_STALL_SECONDS = 3600
+    # Ingest ticks that may fail in a row (unreadable file, lost state)
+    # before the video is settled as "failed"
+    INGEST_MAX_ERRORS = 5
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
+
+    # "json" keeps state in video.json / windows/*.json; "sqlite" keeps it in
+    # SQLITE_PATH (default MEDIA_ROOT/state.sqlite3); "journal" appends every
+    # transition to <video>/events.jsonl. Both export the JSON files once a
+    # video reaches a terminal status.
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "json")
+    SQLITE_PATH = os.getenv("SQLITE_PATH")
+    STATE_CACHE_SIZE = 512  # parsed JSON documents kept in memory per process
+    JOURNAL_CACHE_SIZE = 256  # folded journal snapshots kept in memory per process
+
+    # Artifact blobs: "local" (MEDIA_ROOT) or "s3" (any S3-compatible endpoint,
+    # e.g. MinIO or a moto server via S3_ENDPOINT_URL)
+    BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local")
+    S3_BUCKET = os.getenv("S3_BUCKET", "conciseai")
+    S3_PREFIX = os.getenv("S3_PREFIX", "")
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+    S3_REGION = os.getenv("S3_REGION")
+    S3_PRESIGN_SECONDS = 3600
+    S3_PART_SIZE = 64 * 1024 * 1024
+    S3_UPLOAD_THREADS = 8
+
+    # Pack each window's keyframes into frames/<index>.pack (one inode instead
+    # of a directory of JPGs); frame URIs keep working through /media
+    PACK_FRAMES = os.getenv("PACK_FRAMES", "0") == "1"
+
+    # Retention: when set, a background collector keeps MEDIA_ROOT under this
+    # many bytes by evicting masters of the least recently accessed videos
+    DISK_QUOTA_BYTES = int(os.getenv("DISK_QUOTA_BYTES", "0")) or None
+    RETENTION_INTERVAL_SECONDS = 5
+    RETENTION_BATCH = 20  # videos measured per tick
+
+    # Window phases that write state through to disk (terminal states always do);
+    # other progress updates stay in memory until the next checkpoint
+    STATE_CHECKPOINTS = ["start"]
+
+    # Events retained per video for SSE replay (Last-Event-ID / late joiners)
+    SSE_RING_SIZE = 256
+    # "inprocess", or "unix" to share events between all processes (gunicorn
+    # workers, standalone pipeline workers) through a hub on BROKER_SOCKET
+    BROKER_TRANSPORT = os.getenv("BROKER_TRANSPORT", "inprocess")
+    BROKER_SOCKET = os.getenv("BROKER_SOCKET", "/tmp/conciseai-broker.sock")
+    # Non-zero: also serve /videos/<id>/events from an asyncio server on this
+    # port (one thread for all subscribers) alongside the Flask route
+    SSE_HOST = os.getenv("SSE_HOST", "0.0.0.0")
+    SSE_PORT = int(os.getenv("SSE_PORT", "0"))
+    SSE_HEARTBEAT_SECONDS = 15
+    # A subscriber that falls behind the retained events either skips to the
+    # oldest one ("drop_oldest") or is disconnected with a resync hint ("disconnect")
+    SSE_OVERFLOW = os.getenv("SSE_OVERFLOW", "drop_oldest")
+    # Window progress updates per (video, window, phase) are merged over this interval
+    SSE_PROGRESS_INTERVAL_SECONDS = 0.5
+    # Per-video topics without subscribers are forgotten after this long
+    SSE_TOPIC_TTL_SECONDS = 600
+
+    # Jobs: "thread" runs the pipeline inside the web process,
+    # "queue" drops jobs into MEDIA_ROOT/queue for `python -m app.workers`
+    JOB_BACKEND = os.getenv("JOB_BACKEND", "thread")
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+    WORKER_POLL_SECONDS = 1.0
+    WORKER_MAX_ACTIVE_VIDEOS = int(os.getenv("WORKER_MAX_ACTIVE_VIDEOS", "4"))
+
+    # Concurrent heavy subprocesses per kind, shared by every process on the host
+    PROC_LIMITS = {
+        "ffmpeg": max(1, (os.cpu_count() or 2) // 2),
+        "ffprobe": 4,
+        "tesseract": os.cpu_count() or 2,
+    }
+    PROC_LOCK_DIR = os.getenv("PROC_LOCK_DIR", os.path.join(BASE_DIR, ".locks"))
+
+def load(obj=Config):
+    """Plain dict of the upper-case settings (what Flask's from_object picks up)."""
+    return {k: getattr(obj, k) for k in dir(obj) if k.isupper()}
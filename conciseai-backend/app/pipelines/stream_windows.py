@@ -1,7 +1,7 @@
-import os
-from flask import current_app
-from app.services import storage, windowing
-from app.sse.broker import publish
+import os, subprocess, time
+from app.services import storage, windowing, procs, mediaio, state
+from app.sse.broker import publish, progress
+from app.utils.errors import JobCancelled, UnsupportedMedia
 
 # Import your service adapters
 from app.services import frames as framesvc
@@ -17,169 +17,376 @@ except Exception:
 def _ensure_dir(p):  # tiny helper
     os.makedirs(p, exist_ok=True)
 
-def run(video_id: str, master_path: str):
+# Ingest mode (video still uploading): how often to look for newly arrived
+# windows, how far behind the last fully arrived packet to stay, and when to
+# give up on an upload that stopped growing
+INGEST_POLL_SECONDS = 5
+INGEST_MARGIN_SECONDS = 2
+INGEST_STALL_SECONDS = 3600
+# Ingest ticks that may fail in a row before the video is given up as failed
+INGEST_MAX_ERRORS = 5
+
+def configure(config):
+    global INGEST_POLL_SECONDS, INGEST_MARGIN_SECONDS, INGEST_STALL_SECONDS, INGEST_MAX_ERRORS
+    INGEST_POLL_SECONDS = config.get("INGEST_POLL_SECONDS", INGEST_POLL_SECONDS)
+    INGEST_MARGIN_SECONDS = config.get("INGEST_MARGIN_SECONDS", INGEST_MARGIN_SECONDS)
+    INGEST_STALL_SECONDS = config.get("INGEST_STALL_SECONDS", INGEST_STALL_SECONDS)
+    INGEST_MAX_ERRORS = config.get("INGEST_MAX_ERRORS", INGEST_MAX_ERRORS)
+
+def _plan_windows(v, master_path):
+    """Content-aware boundaries when configured for the video, else fixed cuts."""
+    step = v.get("window_seconds", 600)
+    tol = v.get("window_tolerance_sec", 0)
+    if v.get("window_planner") == "content" and tol > 0:
+        try:
+            wins = windowing.plan(
+                v["duration_sec"], step, tol,
+                scan=lambda t0, t1: mediaio.scan_boundaries(master_path, t0, t1, has_audio=_has_audio(v))
+            )
+            return wins, "content"
+        except (subprocess.CalledProcessError, ValueError):
+            pass  # unscannable input: fall back to fixed cuts
+    return list(windowing.windows(v["duration_sec"], step)), "fixed"
+
+def start(video_id: str, master_path: str):
+    """
+    Mark the video processing and return its window plan (None if unknown).
+    The plan is persisted in video.json before any window runs and reused
+    if the job is restarted. A video still "ingesting" keeps that status and
+    gets only the windows that have arrived so far; see ingest_tick.
+    """
+    js = state.open(video_id)
+    if js is None:
+        return None
+    procs.check()
+
+    v = js.video
+    if v.get("status") == "ingesting":
+        # Windows already done (an ingest resumed after a stall) stay done
+        todo = [w for w in v.get("windows", []) if w.get("status") != "done"]
+        wins = [{"index": w["index"], "t_start": w["t_start"], "t_end": w["t_end"]} for w in todo]
+        v["plan"] = {
+            "method": "content" if _content_planned(v) else "fixed",
+            "target_sec": v.get("window_seconds", 600),
+            "tolerance_sec": v.get("window_tolerance_sec", 0),
+        }
+        v["windows"] = [w if w.get("status") == "done" else _brief(w) for w in v.get("windows", [])]
+        js.save_video()
+        return wins  # the caller asks ingest_tick for more
+    storage.ensure_local(master_path)
+    if v.get("plan") and v.get("windows"):
+        wins = [{"index": w["index"], "t_start": w["t_start"], "t_end": w["t_end"]} for w in v["windows"]]
+    else:
+        wins, method = _plan_windows(v, master_path)
+        v["plan"] = {
+            "method": method,
+            "target_sec": v.get("window_seconds", 600),
+            "tolerance_sec": v.get("window_tolerance_sec", 0),
+        }
+
+    v["status"] = "processing"
+    v["windows"] = [_brief(w) for w in wins]
+    js.save_video()
+    return wins
+
+def index_keyframes(video_id: str, master_path: str):
+    """
+    Build the keyframe index left out of the upload's header probe: one
+    demux pass over the whole master, so the scheduler runs it behind the
+    video's windows. A file that doesn't demux cleanly keeps no index.
+    """
+    procs.check()
+    js = state.open(video_id)
+    if js is None or not js.video.get("media") or js.video["media"].get("keyframes") is not None:
+        return
+    try:
+        keyframes = mediaio.probe(master_path)["keyframes"] or []
+    except (subprocess.CalledProcessError, KeyError, ValueError):
+        return
+    media = storage.save_media_info(video_id, dict(js.video["media"], keyframes=keyframes))
+    storage.publish_artifacts([media["keyframes"]["uri"]])
+    js.update_video(media=media)
+
+def _brief(w):
+    return {"id": f"w_{w['index']:03d}", "index": w["index"], "t_start": w["t_start"], "t_end": w["t_end"], "status": "pending"}
+
+def _has_audio(v):
+    # Probed at upload; videos from before that are assumed to have audio
+    return v.get("media", {}).get("has_audio", True)
+
+def _fps(v):
+    return (v.get("media", {}).get("video") or {}).get("fps")
+
+def _content_planned(v):
+    return v.get("window_planner") == "content" and v.get("window_tolerance_sec", 0) > 0
+
+def _scan(v, master_path):
+    if not _content_planned(v):
+        return None
+    def scan(t0, t1):
+        try:
+            return mediaio.scan_boundaries(master_path, t0, t1, has_audio=_has_audio(v))
+        except (subprocess.CalledProcessError, ValueError):
+            return [], []  # unscannable stretch: keep the plain cut
+    return scan
+
+def ingest_tick(video_id: str, master_path: str):
     """
-    For each 10-min window:
+    Ingest mode: plan the windows that have fully arrived since the last
+    call, going by the byte positions of the partial file's packets. Once the
+    upload is complete the file gets its full probe (keyframe index
+    included), the rest of the video is planned and the status becomes
+    "processing". Returns (new windows, done). Raises UnsupportedMedia if
+    the finished upload isn't a readable video.
+    """
+    from app.services import uploads
+    procs.check()
+    js = state.open(video_id)
+    if js is None:  # video deleted meanwhile
+        return [], True
+    v = js.video
+    s = uploads.get(video_id)
+    if s is not None and s["status"] == "rejected":
+        raise UnsupportedMedia(s["error"])
+    prev = [{"index": w["index"], "t_start": w["t_start"], "t_end": w["t_end"]} for w in v["windows"]]
+    step, tol = v.get("window_seconds", 600), v.get("window_tolerance_sec", 0)
+    if s is None or s["status"] == "complete":
+        try:
+            media = mediaio.probe(master_path)
+            duration = int(media["duration_sec"])
+        except (subprocess.CalledProcessError, KeyError, ValueError):
+            raise UnsupportedMedia("unreadable video")
+        if media["video"] is None:
+            raise UnsupportedMedia("no video stream")
+        media = storage.save_media_info(video_id, media)
+        storage.publish_artifacts([media["keyframes"]["uri"]])
+        scan = _scan(dict(v, media=media), master_path)
+        wins = windowing.plan(duration, step, tol if _content_planned(v) else 0, scan, prev=prev)
+        done = {"duration_sec": duration, "status": "processing", "media": media}
+        if s is not None:
+            done.update(sha256=s["sha256"], size_bytes=s["offset"], container=s.get("container"),
+                        ingest={"bytes": s["offset"], "size": s["offset"], "available_sec": duration})
+        js.update_video([_brief(w) for w in wins], **done)
+        publish(video_id, {"type": "video_ingested", "duration_sec": duration, "windows": len(v["windows"])})
+        return wins, True
+    if time.time() - os.path.getmtime(master_path) > INGEST_STALL_SECONDS:
+        # Upload abandoned: finish the windows planned so far; finish() parks
+        # the video as "stalled" until the upload is completed after all
+        js.update_video(status="processing", ingest_stalled=True)
+        return [], True
+    offset = s["offset"]
+    arrived = v.get("ingest", {}).get("arrived_sec", 0)
+    try:
+        # Only packets whose bytes are all in count; skip most of what an
+        # earlier tick has already seen
+        now, header = mediaio.probe_arrival(master_path, offset, since=max(arrived - 60, 0))
+    except (subprocess.CalledProcessError, KeyError, ValueError):
+        return [], False  # partial file unreadable right now; try next tick
+    if now is None:
+        return [], False
+    arrived = max(arrived, now)
+    duration = int(max(v.get("duration_sec") or 0, header or 0, arrived))
+    available = arrived - INGEST_MARGIN_SECONDS
+    wins = windowing.extend(prev, available, step, tol if _content_planned(v) else 0, _scan(v, master_path))
+    ingest = {"bytes": offset, "size": s["size"], "arrived_sec": round(arrived, 3),
+              "available_sec": round(max(available, 0), 1)}
+    js.update_video([_brief(w) for w in wins], duration_sec=duration, ingest=ingest)
+    publish(video_id, {"type": "video_ingest", **ingest, "duration_sec": duration})
+    return wins, False
+
+def process_window(video_id: str, master_path: str, win: dict):
+    """
+    For one window:
       1) Transcribe window audio (if available, else write placeholder)
       2) Extract vital frames using your frames.py adapter
       3) (Optional) Align frames<->transcript
       4) Summarize window (if available, else placeholder summary)
       5) Update window state JSON, emit SSE events
+    Raises JobCancelled (after recording it) if the job is cancelled.
     """
-    v = storage.read_json(storage.video_json_path(video_id))
-    if not v:
-        return
+    procs.check()
+    js = state.open(video_id)
+    idx = win["index"]
+    # Initialize window state
+    wstate = {
+        "id": f"w_{idx:03d}",
+        "video_id": video_id,
+        "index": idx,
+        "t_start": win["t_start"],
+        "t_end": win["t_end"],
+        "status": "processing",
+        "progress": {"phase": "start", "pct": 0}
+    }
+    js.put_window(idx, wstate, "start")
+    publish(video_id, {"type": "window_started", "index": idx})
 
-    v["status"] = "processing"
-    storage.write_video_state(v)
-
-    window_seconds = v.get("window_seconds", 600)
-
-    for win in windowing.windows(v["duration_sec"], window_seconds):
-        idx = win["index"]
-        # Initialize window state
-        wstate = {
-            "id": f"w_{idx:03d}",
-            "video_id": video_id,
-            "index": idx,
-            "t_start": win["t_start"],
-            "t_end": win["t_end"],
-            "status": "processing",
-            "progress": {"phase": "start", "pct": 0}
-        }
-        storage.write_window_state(video_id, idx, wstate)
-        publish(video_id, {"type": "window_started", "index": idx})
+    try:
+        # -----------------------
+        # 1) TRANSCRIPTION
+        # -----------------------
+        tdir = os.path.join(storage.video_dir(video_id), "transcripts")
+        _ensure_dir(tdir)
 
-        try:
-            # -----------------------
-            # 1) TRANSCRIPTION
-            # -----------------------
-            tdir = os.path.join(storage.video_dir(video_id), "transcripts")
-            _ensure_dir(tdir)
-
-            if transcriptionsvc and hasattr(transcriptionsvc, "run"):
-                t_result = transcriptionsvc.run(
-                    master_path,
-                    win["t_start"],
-                    win["t_end"],
-                    out_dir=tdir
-                )
-                # Expect t_result like: {"uri": "/media/.../transcripts/<idx>.json", "segments":[...]}
-                wstate["transcript_uri"] = t_result.get("uri")
-            else:
-                # Placeholder transcript
-                tpath = os.path.join(tdir, f"{idx}.json")
-                storage._atomic_write_json(tpath, {
-                    "segments": [
-                        {"t_start": win["t_start"], "t_end": win["t_end"], "text": "(transcript placeholder)"}
-                    ]
-                })
-                wstate["transcript_uri"] = f"/media/videos/{video_id}/transcripts/{idx}.json"
-
-            wstate["progress"] = {"phase": "transcribe", "pct": 100}
-            storage.write_window_state(video_id, idx, wstate)
-            publish(video_id, {"type": "window_transcribed", "index": idx})
-
-            # -----------------------
-            # 2) VITAL FRAMES (YOUR NOTEBOOK LOGIC via frames.py)
-            # -----------------------
-            fdir = os.path.join(storage.video_dir(video_id), "frames", str(idx))
-            _ensure_dir(fdir)
-
-            keyframes = framesvc.select(
+        if transcriptionsvc and hasattr(transcriptionsvc, "run"):
+            t_result = transcriptionsvc.run(
                 master_path,
                 win["t_start"],
                 win["t_end"],
-                fdir,
-                candidate_fps=2.0,   # tune to your method
-                top_k=6              # tune to your UI/summary needs
+                out_dir=tdir
             )
-            # Convert file names to web URIs
-            wstate["frames"] = [
-                {"t": fr["t"], "uri": f"/media/videos/{video_id}/frames/{idx}/{fr['name']}"}
-                for fr in keyframes
-            ]
-            wstate["progress"] = {"phase": "frames", "pct": 100}
-            storage.write_window_state(video_id, idx, wstate)
-            publish(video_id, {"type": "window_frames", "index": idx})
-
-            # -----------------------
-            # 3) (Optional) ALIGNMENT
-            # -----------------------
-            # If you add an alignment service, call it here to attach frame timestamps to nearby transcript segments.
-            # Example:
-            # from app.services import alignment as alignsvc
-            # pairs = alignsvc.attach(keyframes, transcript_json)
-            # (Then pass `pairs` into summarization.)
-
-            # -----------------------
-            # 4) SUMMARIZATION
-            # -----------------------
-            sdir = os.path.join(storage.video_dir(video_id), "summaries")
-            _ensure_dir(sdir)
-
-            if summarizationsvc and hasattr(summarizationsvc, "summarize_window"):
-                # Expected signature:
-                # summarize_window(pairs_or_frames, transcript_obj, out_dir, index) -> {"uri": "..."}
-                # If you don't have alignment yet, pass frames + transcript separately or adapt your function.
-                # Load transcript JSON for convenience:
-                transcript_abs = os.path.join(storage.media_root(), wstate["transcript_uri"].lstrip("/"))
-                transcript_obj = storage.read_json(transcript_abs) or {}
-
-                summ_res = summarizationsvc.summarize_window(
-                    frames=wstate.get("frames", []),
-                    transcript=transcript_obj,
-                    out_dir=sdir,
-                    index=idx
-                )
-                wstate["summary_uri"] = summ_res.get("uri")
-            else:
-                # Placeholder summary
-                spath = os.path.join(sdir, f"{idx}.json")
-                storage._atomic_write_json(spath, {
-                    "summary": f"Summary for {int(win['t_start'])}–{int(win['t_end'])} s (placeholder).",
-                    "frames": wstate.get("frames", []),
-                    "transcript_uri": wstate.get("transcript_uri")
-                })
-                wstate["summary_uri"] = f"/media/videos/{video_id}/summaries/{idx}.json"
-
-            wstate["status"] = "done"
-            wstate["progress"] = {"phase": "summarize", "pct": 100}
-            storage.write_window_state(video_id, idx, wstate)
-            publish(video_id, {"type": "window_done", "index": idx, "summary_uri": wstate["summary_uri"]})
-
-        except Exception as e:
-            # Mark this window failed and continue with the next
-            wstate["status"] = "failed"
-            wstate["error"] = str(e)
-            storage.write_window_state(video_id, idx, wstate)
-            publish(video_id, {"type": "window_failed", "index": idx, "error": str(e)})
-
-        # Update top-level video state (brief window list)
-        v = storage.read_json(storage.video_json_path(video_id))
-        brief = {
-            "id": wstate["id"],
-            "index": idx,
-            "t_start": wstate["t_start"],
-            "t_end": wstate["t_end"],
-            "status": wstate["status"]
-        }
-        # Keep windows[] ordered by index
-        if len(v.get("windows", [])) <= idx:
-            # pad if needed
-            while len(v["windows"]) < idx:
-                v["windows"].append({"id": f"w_{len(v['windows']):03d}", "index": len(v["windows"]), "status": "skipped"})
-            v["windows"].append(brief)
+            # Expect t_result like: {"uri": "/media/.../transcripts/<idx>.json", "segments":[...]}
+            wstate["transcript_uri"] = t_result.get("uri")
+        else:
+            # Placeholder transcript
+            tpath = os.path.join(tdir, f"{idx}.json")
+            storage._atomic_write_json(tpath, {
+                "segments": [
+                    {"t_start": win["t_start"], "t_end": win["t_end"], "text": "(transcript placeholder)"}
+                ]
+            })
+            wstate["transcript_uri"] = f"/media/videos/{video_id}/transcripts/{idx}.json"
+
+        wstate["progress"] = {"phase": "transcribe", "pct": 100}
+        js.put_window(idx, wstate, "transcribe")
+        publish(video_id, {"type": "window_transcribed", "index": idx})
+        procs.check()
+
+        # -----------------------
+        # 2) VITAL FRAMES (YOUR NOTEBOOK LOGIC via frames.py)
+        # -----------------------
+        fdir = os.path.join(storage.video_dir(video_id), "frames", str(idx))
+        _ensure_dir(fdir)
+
+        keyframes = framesvc.select(
+            master_path,
+            win["t_start"],
+            win["t_end"],
+            fdir,
+            candidate_fps=min(2.0, _fps(js.video) or 2.0),   # tune to your method; never above the source rate
+            top_k=6,             # tune to your UI/summary needs
+            on_progress=lambda pct: progress(video_id, idx, "frames", pct)
+        )
+        # Convert file names to web URIs
+        wstate["frames"] = [
+            {"t": fr["t"], "uri": f"/media/videos/{video_id}/frames/{idx}/{fr['name']}"}
+            for fr in keyframes
+        ]
+        if storage.pack_frames_enabled() and keyframes:
+            # One file per window; frame URIs still resolve via /media
+            pack_uri, pack_index = storage.pack_window_frames(video_id, idx, fdir, [fr["name"] for fr in keyframes])
+            wstate["frames_pack_uri"] = pack_uri
+            for fr, kf in zip(wstate["frames"], keyframes):
+                fr["range"] = pack_index[kf["name"]]
+        wstate["progress"] = {"phase": "frames", "pct": 100}
+        js.put_window(idx, wstate, "frames")
+        publish(video_id, {"type": "window_frames", "index": idx})
+        procs.check()
+
+        # -----------------------
+        # 3) (Optional) ALIGNMENT
+        # -----------------------
+        # If you add an alignment service, call it here to attach frame timestamps to nearby transcript segments.
+        # Example:
+        # from app.services import alignment as alignsvc
+        # pairs = alignsvc.attach(keyframes, transcript_json)
+        # (Then pass `pairs` into summarization.)
+
+        # -----------------------
+        # 4) SUMMARIZATION
+        # -----------------------
+        sdir = os.path.join(storage.video_dir(video_id), "summaries")
+        _ensure_dir(sdir)
+
+        if summarizationsvc and hasattr(summarizationsvc, "summarize_window"):
+            # Expected signature:
+            # summarize_window(pairs_or_frames, transcript_obj, out_dir, index) -> {"uri": "..."}
+            # If you don't have alignment yet, pass frames + transcript separately or adapt your function.
+            # Load transcript JSON for convenience:
+            transcript_abs = storage.media_path(wstate["transcript_uri"])
+            transcript_obj = storage.read_json(transcript_abs) or {}
+
+            summ_res = summarizationsvc.summarize_window(
+                frames=wstate.get("frames", []),
+                transcript=transcript_obj,
+                out_dir=sdir,
+                index=idx
+            )
+            wstate["summary_uri"] = summ_res.get("uri")
         else:
-            v["windows"][idx] = brief
-        storage.write_video_state(v)
-
-    # All windows attempted
-    v = storage.read_json(storage.video_json_path(video_id)) or {"id": video_id}
-    # If any failed, you can keep status "processing" or set "done_with_errors"
-    final_status = "done"
-    if any(w.get("status") == "failed" for w in v.get("windows", [])):
-        final_status = "done_with_errors"
+            # Placeholder summary
+            spath = os.path.join(sdir, f"{idx}.json")
+            storage._atomic_write_json(spath, {
+                "summary": f"Summary for {int(win['t_start'])}–{int(win['t_end'])} s (placeholder).",
+                "frames": wstate.get("frames", []),
+                "transcript_uri": wstate.get("transcript_uri")
+            })
+            wstate["summary_uri"] = f"/media/videos/{video_id}/summaries/{idx}.json"
+
+        # Artifacts must be reachable before clients hear about them
+        frame_uris = [wstate["frames_pack_uri"]] if "frames_pack_uri" in wstate else [fr["uri"] for fr in wstate.get("frames", [])]
+        storage.publish_artifacts([wstate.get("transcript_uri"), wstate.get("summary_uri")] + frame_uris)
+
+        wstate["status"] = "done"
+        wstate["progress"] = {"phase": "summarize", "pct": 100}
+        js.put_window(idx, wstate, "summarize")
+        publish(video_id, {"type": "window_done", "index": idx, "summary_uri": wstate["summary_uri"]})
+
+    except JobCancelled:
+        wstate["status"] = "cancelled"
+        js.put_window(idx, wstate, "cancelled")
+        raise
+    except Exception as e:
+        # Mark this window failed and continue with the next
+        wstate["status"] = "failed"
+        wstate["error"] = str(e)
+        js.put_window(idx, wstate, "failed")
+        publish(video_id, {"type": "window_failed", "index": idx, "error": str(e)})
+
+def finish(video_id: str, cancelled: bool = False, error: str = None):
+    """
+    All windows attempted (or the job was cancelled, or it failed with
+    `error` before its windows could run): settle the video status and
+    publish it. A stalled ingest is parked as "stalled" instead; returns True if
+    its upload has been completed meanwhile and the job must go on
+    ingesting (the caller resubmits it).
+    """
+    js = state.open(video_id)
+    if js is None:
+        procs.clear_cancel(video_id)
+        return False
+    v = js.video
+    if v.get("ingest_stalled") and not cancelled and error is None:
+        from app.services import uploads
+        # Under the session lock, so this and complete_upload agree on who resumes
+        with uploads.locked(video_id) as s:
+            resume = s is not None and s["status"] == "complete"
+            if resume:
+                v.pop("ingest_stalled")
+            v["status"] = "ingesting" if resume else "stalled"
+            state.close(video_id)
+        procs.clear_cancel(video_id)
+        if not resume:
+            publish(video_id, {"type": "video_stalled"})
+        return resume
+    if cancelled:
+        final_status = "cancelled"
+    elif error is not None:
+        final_status = "failed"
+        v["error"] = error
+    else:
+        # If any failed, you can keep status "processing" or set "done_with_errors"
+        final_status = "done"
+        if any(w.get("status") == "failed" for w in v.get("windows", [])):
+            final_status = "done_with_errors"
     v["status"] = final_status
-    storage.write_video_state(v)
-    publish(video_id, {"type": "video_done", "status": final_status})
+    state.close(video_id)
+    # After the status is written: a cancel that raced us sees it and clears its own flag
+    procs.clear_cancel(video_id)
+    if cancelled:
+        publish(video_id, {"type": "video_cancelled"})
+    else:
+        done = {"type": "video_done", "status": final_status}
+        if error is not None:
+            done["error"] = error
+        publish(video_id, done)
+    return False
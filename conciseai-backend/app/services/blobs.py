@@ -0,0 +1,123 @@
+"""
+Blob storage for media artifacts (masters, keyframes, transcripts, summaries).
+
+Keys are media-relative paths ("videos/<id>/frames/0/000.jpg"), i.e. the
+/media URI without its prefix. The pipeline always works on local files under
+MEDIA_ROOT; the blob store is where finished artifacts are published and
+where other hosts fetch masters from.
+
+  local  MEDIA_ROOT itself; publishing is a no-op, /media serves from disk
+  s3     any S3-compatible service (AWS, MinIO, a moto server for local
+         runs via S3_ENDPOINT_URL); masters go up as multipart uploads,
+         window artifacts in parallel, /media redirects to presigned URLs
+"""
+
+import os, shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional dep
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except Exception:
+    boto3 = None
+
+class LocalBlobStore:
+    def __init__(self, root, resolve=None):
+        self.root = root
+        self.resolve = resolve  # key -> local path, for non-trivial layouts
+
+    def path(self, key):
+        if self.resolve:
+            return self.resolve(key)
+        return os.path.join(self.root, *key.split("/"))
+
+    def put_file(self, key, path):
+        # Artifacts are produced in place, so this is normally a no-op
+        if os.path.abspath(path) != os.path.abspath(self.path(key)):
+            os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+            shutil.copyfile(path, self.path(key))
+
+    def put_many(self, items):
+        for key, path in items:
+            self.put_file(key, path)
+
+    def fetch(self, key, dest):
+        # Masters already live at their key: nothing to copy, but it must exist
+        if os.path.abspath(dest) != os.path.abspath(self.path(key)) or not os.path.exists(dest):
+            raise FileNotFoundError(key)
+
+    def read_range(self, key, offset, length):
+        with open(self.path(key), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def url(self, key):
+        return None  # served by the /media route
+
+class S3BlobStore:
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None,
+                 presign_seconds=3600, part_size=64 * 1024 * 1024, upload_threads=8):
+        if boto3 is None:
+            raise RuntimeError("boto3 is required for BLOB_BACKEND=s3. `pip install boto3`")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.presign_seconds = presign_seconds
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        # Files above part_size are streamed from disk as multipart uploads
+        self.transfer = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                                       max_concurrency=upload_threads)
+        self.upload_threads = upload_threads
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put_file(self, key, path):
+        self.client.upload_file(path, self.bucket, self._key(key), Config=self.transfer)
+
+    def put_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.upload_threads, len(items))) as pool:
+            for f in [pool.submit(self.put_file, k, p) for k, p in items]:
+                f.result()
+
+    def fetch(self, key, dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = dest + ".part"
+        try:
+            self.client.download_file(self.bucket, self._key(key), tmp, Config=self.transfer)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise FileNotFoundError(key)
+            raise
+        os.replace(tmp, dest)
+
+    def read_range(self, key, offset, length):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._key(key),
+                                         Range=f"bytes={offset}-{offset + length - 1}")
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+        return obj["Body"].read()
+
+    def url(self, key):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._key(key)},
+            ExpiresIn=self.presign_seconds,
+        )
+
+def from_config(config, media_root, resolve=None):
+    if config.get("BLOB_BACKEND", "local") == "s3":
+        return S3BlobStore(
+            config["S3_BUCKET"],
+            prefix=config.get("S3_PREFIX", ""),
+            endpoint_url=config.get("S3_ENDPOINT_URL"),
+            region=config.get("S3_REGION"),
+            presign_seconds=config.get("S3_PRESIGN_SECONDS", 3600),
+            part_size=config.get("S3_PART_SIZE", 64 * 1024 * 1024),
+            upload_threads=config.get("S3_UPLOAD_THREADS", 8),
+        )
+    return LocalBlobStore(media_root, resolve)
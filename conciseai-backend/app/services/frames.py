@@ -12,9 +12,10 @@ Returns:
   [{"t": <seconds>, "name": "000.jpg"}, ...]   # sorted by time
 """
 
-import os, subprocess, glob, tempfile
-from typing import List, Dict, Tuple, Optional
+import os, glob, tempfile
+from typing import Callable, List, Dict, Tuple, Optional
 import numpy as np
+from app.services import procs
 
 # Optional deps
 try:
@@ -55,13 +56,23 @@ def _extract_window_pngs(video_path: str, t_start: float, t_end: float, tmp_dir:
         "-q:v", "2",
         os.path.join(tmp_dir, "%06d.png"),
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    procs.run(cmd)
 
 def _timestamp_from_index(idx_zero_based: int, t_start: float, fps: float) -> float:
     return t_start + (idx_zero_based / fps)
 
 # ---------------- scoring primitives ----------------
 
+def _ocr_text(gray: np.ndarray) -> str:
+    """
+    Run the tesseract binary (as configured for pytesseract) through procs.run
+    so the OCR child is governed and dies with a cancelled job.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".png") as f:
+        cv2.imwrite(f.name, gray)
+        out = procs.run([pytesseract.pytesseract.tesseract_cmd, f.name, "stdout"], capture=True)
+    return out.decode("utf-8", errors="replace")
+
 def _entropy_score(img: np.ndarray) -> float:
     """Shannon entropy on grayscale histogram (0..~8)."""
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -80,7 +91,7 @@ def _ocr_len_score(img: np.ndarray) -> float:
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     # light denoise → binarize helps on lecture slides
     gray = cv2.medianBlur(gray, 3)
-    text = pytesseract.image_to_string(gray)
+    text = _ocr_text(gray)
     return float(len(text.strip()))
 
 def _semantic_score(
@@ -101,7 +112,7 @@ def _semantic_score(
     # Extract text
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     gray = cv2.medianBlur(gray, 3)
-    text = pytesseract.image_to_string(gray).strip()
+    text = _ocr_text(gray).strip()
     if not text:
         return 0.0
     emb = _ST_MODEL.encode([text], convert_to_tensor=True, normalize_embeddings=True)
@@ -142,13 +153,15 @@ def select(
     candidate_fps: float = 2.0,
     top_k: int = 6,
     min_gap_factor: float = 1.5,
-    lecture_prompt: Optional[str] = None
+    lecture_prompt: Optional[str] = None,
+    on_progress: Optional[Callable[[int], None]] = None
 ) -> List[Dict]:
     """
     1) Extract candidate frames at `candidate_fps` within [t_start, t_end)
     2) Score via hybrid entropy+OCR(+semantic)
     3) Select top_k with temporal spacing
     4) Save to out_dir as JPGs
+    `on_progress(pct)` is called as candidates are scored.
     Returns: [{"t": seconds, "name": "000.jpg"}, ...] sorted by t
     """
     if cv2 is None:
@@ -172,12 +185,15 @@ def select(
 
         # Score each candidate
         scored: List[Tuple[str, float]] = []
-        for p in pngs:
+        for n, p in enumerate(pngs, 1):
+            procs.check()
             img = cv2.imread(p)
             if img is None:
                 continue
             s = _hybrid_score(img, prompt_emb=st_prompt_emb)
             scored.append((p, float(s)))
+            if on_progress:
+                on_progress(100 * n // len(pngs))
 
         # Sort desc by score
         scored.sort(key=lambda x: x[1], reverse=True)
@@ -208,10 +224,7 @@ def select(
             name = f"{i:03d}.jpg"
             out_path = os.path.join(out_dir, name)
             # Convert PNG->JPG with ffmpeg for consistency
-            subprocess.run(
-                ["ffmpeg", "-y", "-i", item["path"], out_path],
-                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
+            procs.run(["ffmpeg", "-y", "-i", item["path"], out_path])
             results.append({"t": round(float(item["t"]), 3), "name": name})
 
         return results
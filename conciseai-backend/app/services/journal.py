@@ -0,0 +1,193 @@
+"""
+Append-only per-video journal (STATE_BACKEND=journal).
+
+Every state transition is one JSON line in <video_dir>/events.jsonl:
+
+  {"k": "video", "doc": {...}}              write_video_state
+  {"k": "window", "i": 3, "doc": {...}}     write_window_state
+  {"k": "event", "payload": {...}}          broker.publish
+
+A line's byte offset (plus the journal's base, see compact) is its
+sequence number: unique, monotonic, and usable as an SSE event id. Appends
+take an flock so API and worker processes can share a journal. Snapshots
+(latest video doc + latest doc per window) are folded lazily on read and
+cached for the CACHE_SIZE most recently read videos; later reads only fold
+the bytes appended since.
+
+Once a video settles its journal is compacted to a base line, the final
+documents and the events that replay its outcome: the last done/failed
+event of each window and the last of each video-level event (started,
+ingested, done, ...). Progress and phase events are dropped. A client
+resuming from an id older than the base gets the kept events again, under
+new ids.
+"""
+
+import json, os, threading
+from collections import OrderedDict
+from app.services import storage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_SIZE = 256
+
+_snapshots = OrderedDict()  # video_id -> _Snapshot, least recently read first
+_lock = threading.Lock()
+_BASE_PREFIX = b'{"k":"base"'
+# Events compaction keeps (the last one per window, or per type for the rest)
+_WINDOW_OUTCOMES = ("window_done", "window_failed")
+_VIDEO_EVENTS = ("video_started", "video_ingested", "video_stalled", "video_done", "video_cancelled")
+
+def journal_path(video_id):
+    return os.path.join(storage.video_dir(video_id), "events.jsonl")
+
+def _base(fd):
+    """Sequence number of byte 0 of the journal open as `fd` (0 until compacted)."""
+    head = os.pread(fd, 64, 0)
+    if not head.startswith(_BASE_PREFIX):
+        return 0
+    return json.loads(head.split(b"\n", 1)[0])["n"]
+
+def _open_locked(path):
+    # Compaction replaces the file: retry until the locked fd is the live one
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+def append(video_id, entry):
+    """Append one entry; returns its sequence number."""
+    line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    path = journal_path(video_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = _open_locked(path)
+    try:
+        pos = os.fstat(fd).st_size
+        os.write(fd, line)
+        return _base(fd) + pos
+    finally:
+        os.close(fd)  # also drops the flock
+
+def compact(video_id):
+    """
+    Rewrite the journal as a base line, the current documents and the
+    outcome events (see above). The base keeps sequence numbers of later
+    appends above every one handed out so far.
+    """
+    path = journal_path(video_id)
+    fd = _open_locked(path)
+    try:
+        end = os.fstat(fd).st_size
+        video, windows, kept = None, {}, {}
+        for pos, e, _ in _entries(video_id):
+            if e["k"] == "video":
+                video = e["doc"]
+            elif e["k"] == "window":
+                windows[e["i"]] = e["doc"]
+            elif e["k"] == "event":
+                kind = e["payload"].get("type")
+                if kind in _WINDOW_OUTCOMES:
+                    kept[("window", e["payload"].get("index"))] = (pos, e)
+                elif kind in _VIDEO_EVENTS:
+                    kept[kind] = (pos, e)
+        lines = [{"k": "base", "n": _base(fd) + end}]
+        if video is not None:
+            lines.append({"k": "video", "doc": video})
+        lines += [{"k": "window", "i": i, "doc": windows[i]} for i in sorted(windows)]
+        lines += [e for _, e in sorted(kept.values(), key=lambda pe: pe[0])]
+        tmp = path + ".compact"
+        with open(tmp, "wb") as f:
+            for e in lines:
+                f.write((json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        os.close(fd)
+    with _lock:
+        _snapshots.pop(video_id, None)
+
+def _entries(video_id, offset=0, skip_first=False):
+    """Yield (seq, entry, next_offset) for complete lines from `offset` on."""
+    try:
+        f = open(journal_path(video_id), "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        yield from _lines(f, offset, skip_first)
+
+def _lines(f, offset, skip_first=False):
+    f.seek(offset)
+    pos = offset
+    if skip_first:
+        pos += len(f.readline())
+    for raw in f:
+        if not raw.endswith(b"\n"):
+            break  # append in progress
+        yield pos, json.loads(raw), pos + len(raw)
+        pos += len(raw)
+
+class _Snapshot:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset(None)
+
+    def reset(self, ino):
+        self.ino = ino  # journal file folded so far; compaction replaces it
+        self.offset = 0
+        self.video = None
+        self.windows = {}
+
+    def refresh(self, f):
+        ino = os.fstat(f.fileno()).st_ino
+        if ino != self.ino:
+            self.reset(ino)  # compacted since: fold the new file from the start
+        for _, e, end in _lines(f, self.offset):
+            if e["k"] == "video":
+                self.video = e["doc"]
+            elif e["k"] == "window":
+                self.windows[e["i"]] = e["doc"]
+            self.offset = end
+
+def snapshot(video_id):
+    """Materialized (video_doc, {index: window_doc}); treat both as read-only."""
+    with _lock:
+        snap = _snapshots.get(video_id)
+        if snap is None:
+            snap = _snapshots[video_id] = _Snapshot()
+            while len(_snapshots) > CACHE_SIZE:
+                _snapshots.popitem(last=False)
+        else:
+            _snapshots.move_to_end(video_id)
+    with snap.lock:
+        try:
+            f = open(journal_path(video_id), "rb")
+        except FileNotFoundError:
+            return None, {}
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != snap.ino or st.st_size != snap.offset:
+                snap.refresh(f)
+        return snap.video, snap.windows
+
+def events(video_id, after=None):
+    """Replay published events after seq `after` (None = from the start) as (seq, payload)."""
+    try:
+        f = open(journal_path(video_id), "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        base = _base(f.fileno())
+        # An id from before the last compaction: its events are gone, go on from there
+        resume = after is not None and after >= base
+        for pos, e, _ in _lines(f, after - base if resume else 0, skip_first=resume):
+            if e["k"] == "event":
+                yield base + pos, e["payload"]
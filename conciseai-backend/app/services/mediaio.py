@@ -1,4 +1,5 @@
-import subprocess, json
+import json, os, tempfile
+from app.services import procs
 
 def probe_duration_sec(video_path: str) -> int:
     # Uses ffprobe to get duration in seconds (int)
@@ -6,8 +7,192 @@ def probe_duration_sec(video_path: str) -> int:
         "ffprobe","-v","error","-show_entries","format=duration",
         "-of","json", video_path
     ]
-    out = subprocess.check_output(cmd)
+    out = procs.run(cmd, capture=True)
     duration = float(json.loads(out)["format"]["duration"])
     return int(duration)
-   
 
+def probe(video_path: str, keyframes: bool = True) -> dict:
+    """
+    Everything later stages need from one ffprobe run: format, duration,
+    stream layout, the first video stream's size / fps / keyframe times and
+    whether there is audio. Keyframes come from packet flags, which means
+    demuxing the whole file (nothing is decoded); with keyframes=False only
+    the headers are read and "keyframes" is None.
+    """
+    entries = ("format=format_name,duration,bit_rate"
+               ":stream=index,codec_type,codec_name,width,height,avg_frame_rate,channels,sample_rate")
+    if keyframes:
+        entries += ":packet=stream_index,pts_time,flags"
+    cmd = ["ffprobe", "-v", "error", "-show_entries", entries, "-of", "compact", video_path]
+    out = procs.run(cmd, capture=True).decode("utf-8", "replace")
+    fmt, streams, keys = {}, [], {}
+    for line in out.splitlines():
+        section, _, rest = line.partition("|")
+        fields = dict(kv.partition("=")[::2] for kv in rest.split("|"))
+        if section == "packet":
+            if fields.get("flags", "").startswith("K") and fields.get("pts_time", "N/A") != "N/A":
+                keys.setdefault(fields["stream_index"], []).append(round(float(fields["pts_time"]), 3))
+        elif section == "stream":
+            streams.append(fields)
+        elif section == "format":
+            fmt = fields
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    info = {
+        "format": fmt.get("format_name"),
+        "duration_sec": float(fmt["duration"]),
+        "bit_rate": _num(fmt.get("bit_rate"), int),
+        "streams": [{"index": int(st["index"]), "type": st.get("codec_type"), "codec": st.get("codec_name")}
+                    for st in streams],
+        "has_audio": any(st.get("codec_type") == "audio" for st in streams),
+        "video": None,
+        "keyframes": [] if keyframes else None,
+    }
+    if video is not None:
+        info["video"] = {"codec": video.get("codec_name"), "width": _num(video.get("width"), int),
+                         "height": _num(video.get("height"), int), "fps": _rate(video.get("avg_frame_rate"))}
+        if keyframes:
+            info["keyframes"] = sorted(keys.get(video["index"], []))
+    return info
+
+def probe_arrival(video_path: str, offset: int, since: float = 0.0):
+    """
+    For a file still being written: (seconds up to which every audio and
+    video stream's packets lie entirely within the first `offset` bytes,
+    header duration or None). Packets are read from `since` seconds on.
+    The arrival time is None until each stream has a complete packet there.
+    """
+    cmd = [
+        "ffprobe", "-v", "error", "-show_entries",
+        "format=duration:stream=index,codec_type:packet=stream_index,pts_time,pos,size",
+        "-of", "compact",
+    ]
+    if since > 0:
+        cmd += ["-read_intervals", f"{since}%"]
+    out = procs.run(cmd + [video_path], capture=True).decode("utf-8", "replace")
+    fmt, media, arrived = {}, set(), {}
+    for line in out.splitlines():
+        section, _, rest = line.partition("|")
+        fields = dict(kv.partition("=")[::2] for kv in rest.split("|"))
+        if section == "packet":
+            pos, size, pts = (_num(fields.get(k), float) for k in ("pos", "size", "pts_time"))
+            if None not in (pos, size, pts) and pos + size <= offset:
+                si = fields["stream_index"]
+                arrived[si] = max(arrived.get(si, 0.0), pts)
+        elif section == "stream":
+            if fields.get("codec_type") in ("audio", "video"):
+                media.add(fields["index"])
+        elif section == "format":
+            fmt = fields
+    if not media or not media <= set(arrived):
+        return None, _num(fmt.get("duration"), float)
+    return min(arrived[si] for si in media), _num(fmt.get("duration"), float)
+
+def _num(v, cast):
+    try:
+        return cast(v)
+    except (TypeError, ValueError):
+        return None  # "N/A"
+
+def _rate(v):
+    num, _, den = (v or "").partition("/")
+    try:
+        return round(int(num) / int(den), 3) if int(den) else None
+    except ValueError:
+        return None
+
+SNIFF_MIN_BYTES = 12
+
+def sniff_container(head: bytes):
+    """
+    "matroska", "quicktime" or "mp4" from the first bytes of a file; None if
+    they don't look like any container we process (decide only once at
+    least SNIFF_MIN_BYTES are in).
+    """
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "matroska"
+    if head[4:8] == b"ftyp":
+        return "quicktime" if head[8:12] == b"qt  " else "mp4"
+    if head[4:8] in (b"moov", b"mdat", b"free", b"wide", b"skip"):
+        return "quicktime"  # pre-ftyp QuickTime
+    return None
+
+def sniff_streamable(path: str):
+    """
+    Whether the container can be read while still being written: Matroska /
+    WebM, or MP4 whose moov declares fragments (mvex). False for MP4 with
+    the index after the media; None while too little has arrived to tell.
+    """
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    if sniff_container(head) == "matroska":
+        return True
+    pos = 0
+    while pos + 8 <= len(head):
+        size = int.from_bytes(head[pos:pos + 4], "big")
+        kind = head[pos + 4:pos + 8]
+        if size == 1 and pos + 16 <= len(head):
+            size = int.from_bytes(head[pos + 8:pos + 16], "big")
+        if kind == b"moov":
+            if pos + size > len(head):
+                return b"mvex" in head[pos:] or None
+            return b"mvex" in head[pos:pos + size]
+        if kind in (b"mdat", b"moof") or size < 8:
+            return False
+        pos += size
+    return None
+
+def scan_boundaries(video_path: str, t0: float, t1: float,
+                    scene_threshold: float = 0.3, noise_db: int = -35, min_silence: float = 0.6,
+                    has_audio: bool = True):
+    """
+    Cheap scan of [t0, t1) for window boundaries: decodes keyframes only,
+    downscaled, for scene changes, and runs silencedetect on the audio (if
+    there is any). Returns (scene_change_times, silence_midpoints), absolute
+    seconds.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        scenes_txt = os.path.join(tmp, "scenes.txt")
+        silence_txt = os.path.join(tmp, "silence.txt")
+        cmd = [
+            "ffmpeg", "-v", "error", "-nostdin",
+            "-skip_frame", "nokey", "-ss", str(t0), "-t", str(max(t1 - t0, 0.1)),
+            "-copyts", "-i", video_path,
+            "-vf", f"scale=160:-2,select='gt(scene,{scene_threshold})',metadata=print:file={scenes_txt}",
+        ]
+        if has_audio:
+            cmd += ["-af", f"silencedetect=n={noise_db}dB:d={min_silence},ametadata=print:file={silence_txt}"]
+        cmd += ["-f", "null", "-"]
+        procs.run(cmd)
+        scenes = [t for t, _ in _metadata_times(scenes_txt)]
+        silences, start = [], None
+        for t, keys in _metadata_times(silence_txt):
+            if "lavfi.silence_start" in keys:
+                start = keys["lavfi.silence_start"]
+            if "lavfi.silence_end" in keys and start is not None:
+                silences.append((start + keys["lavfi.silence_end"]) / 2)
+                start = None
+    return scenes, silences
+
+def _metadata_times(path):
+    # metadata=print output: "frame:N pts:P pts_time:T" followed by "key=value" lines
+    if not os.path.exists(path):
+        return []
+    out, keys = [], None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("frame:"):
+                try:
+                    t = float(line.rsplit("pts_time:", 1)[-1])
+                except ValueError:
+                    keys = None  # e.g. pts_time:NOPTS: skip the frame and its keys
+                    continue
+                keys = {}
+                out.append((t, keys))
+            elif "=" in line and keys is not None:
+                k, _, val = line.partition("=")
+                try:
+                    keys[k] = float(val)
+                except ValueError:
+                    pass
+    return out
@@ -0,0 +1,103 @@
+"""
+SQLite store for video and window state (STATE_BACKEND=sqlite).
+
+WAL mode with one connection per thread, so API readers never block the
+pipeline's writers. Documents are stored as JSON text next to the columns we
+query on; windows are keyed (video_id, idx) so listing a video's windows is
+one index range scan.
+"""
+
+import json, sqlite3, threading, time
+
+_path = None
+_local = threading.local()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS windows (
+    video_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, idx)
+) WITHOUT ROWID;
+"""
+
+def configure(path):
+    global _path
+    _path = path
+    _local.__dict__.clear()
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != _path:
+        conn = sqlite3.connect(_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        # databases created before the version columns existed
+        for ddl in ("ALTER TABLE videos ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+                    "ALTER TABLE windows ADD COLUMN version INTEGER NOT NULL DEFAULT 0"):
+            try:
+                conn.execute(ddl)
+            except sqlite3.OperationalError:
+                pass
+        _local.conn, _local.path = conn, _path
+    return conn
+
+def _dump(doc):
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
+
+def put_video(doc):
+    _conn().execute(
+        "INSERT INTO videos (id, status, doc, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET status=excluded.status, doc=excluded.doc, "
+        "updated_at=excluded.updated_at, version=videos.version + 1",
+        (doc["id"], doc.get("status", ""), _dump(doc), time.time()),
+    )
+
+def get_video(video_id):
+    row = _conn().execute("SELECT doc FROM videos WHERE id = ?", (video_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def video_version(video_id):
+    row = _conn().execute("SELECT version FROM videos WHERE id = ?", (video_id,)).fetchone()
+    return row[0] if row else None
+
+def put_window(video_id, index, doc):
+    _conn().execute(
+        "INSERT INTO windows (video_id, idx, status, doc, updated_at, version) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(video_id, idx) DO UPDATE SET status=excluded.status, doc=excluded.doc, "
+        "updated_at=excluded.updated_at, version=excluded.version",
+        (video_id, index, doc.get("status", ""), _dump(doc), time.time(), doc.get("version", 0)),
+    )
+
+def list_windows(video_id):
+    rows = _conn().execute("SELECT doc FROM windows WHERE video_id = ? ORDER BY idx", (video_id,))
+    return [json.loads(doc) for (doc,) in rows]
+
+def query_windows(video_id, offset=0, limit=None, status=None, since_version=None):
+    """(total matching, docs for the requested page), filtered in SQL."""
+    where, args = ["video_id = ?"], [video_id]
+    if status:
+        where.append(f"status IN ({','.join('?' * len(status))})")
+        args += list(status)
+    if since_version is not None:
+        where.append("version > ?")
+        args.append(since_version)
+    cond = " AND ".join(where)
+    conn = _conn()
+    total = conn.execute(f"SELECT COUNT(*) FROM windows WHERE {cond}", args).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT doc FROM windows WHERE {cond} ORDER BY idx LIMIT ? OFFSET ?",
+        args + [-1 if limit is None else limit, offset],
+    )
+    return total, [json.loads(doc) for (doc,) in rows]
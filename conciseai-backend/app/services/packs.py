@@ -0,0 +1,47 @@
+"""
+Packed keyframes: one file per window instead of a directory of JPGs.
+
+Layout of frames/<index>.pack:
+
+  b"CAPK1\\n" | uint32 BE n | n bytes JSON {"000.jpg": [offset, length], ...} | frame bytes
+
+Offsets are absolute, so a client (or the /media route) can fetch a single
+frame with one HTTP range read once it knows the index.
+"""
+
+import json, os, struct, tempfile
+
+MAGIC = b"CAPK1\n"
+_HEAD = len(MAGIC) + 4
+
+def write_pack(pack_path, files):
+    """Pack [(name, path), ...] into `pack_path` atomically; returns the index."""
+    blobs, index = [], {}
+    for name, path in files:
+        with open(path, "rb") as f:
+            blobs.append((name, f.read()))
+    # Offsets depend on the index length, which depends on the offsets' digits:
+    # settle it with a padded length prefix
+    sizes = [len(b) for _, b in blobs]
+    n = len(json.dumps({name: [10 ** 12, 10 ** 12] for name, _ in blobs}, separators=(",", ":")))
+    pos = _HEAD + n
+    for (name, _), size in zip(blobs, sizes):
+        index[name] = [pos, size]
+        pos += size
+    raw = json.dumps(index, separators=(",", ":")).encode("utf-8").ljust(n)
+    os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(pack_path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIC + struct.pack(">I", n) + raw)
+        for _, b in blobs:
+            f.write(b)
+    os.replace(tmp, pack_path)
+    return index
+
+def parse_header(read_range):
+    """Index of a pack, given `read_range(offset, length) -> bytes`."""
+    head = read_range(0, _HEAD)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a frame pack")
+    (n,) = struct.unpack(">I", head[len(MAGIC):])
+    return json.loads(read_range(_HEAD, n))
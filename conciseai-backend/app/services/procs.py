@@ -0,0 +1,290 @@
+"""
+Supervised subprocesses for pipeline jobs (ffmpeg, ffprobe, tesseract).
+
+Every heavy child process goes through `run()`, which
+  - waits for a slot from the governor for its kind (per-kind cap, handed out
+    round-robin across jobs, and shared with other processes on the host via
+    flock'd slot files in PROC_LOCK_DIR),
+  - registers it with the calling thread's CancelToken. Cancelling a job (in
+    this process, or from any process via the `cancel` flag file in the video
+    directory) kills those children's process groups and makes the next
+    `check()` raise JobCancelled.
+"""
+
+import os, signal, subprocess, threading, time
+from collections import OrderedDict, deque
+from app.services import storage
+from app.utils.errors import JobCancelled
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process limits only
+    fcntl = None
+
+WATCH_INTERVAL = 0.5  # seconds between cancel-flag polls
+
+def cancel_flag_path(video_id):
+    return os.path.join(storage.video_dir(video_id), "cancel")
+
+class CancelToken:
+    def __init__(self, video_id):
+        self.video_id = video_id
+        self._event = threading.Event()
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            procs = list(self._procs)
+        for p in procs:
+            _kill(p)
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled(self.video_id)
+
+    def attach(self, p):
+        with self._lock:
+            self._procs.add(p)
+        if self._event.is_set():
+            _kill(p)
+
+    def detach(self, p):
+        with self._lock:
+            self._procs.discard(p)
+
+def _kill(p):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+_local = threading.local()
+_watcher = None
+
+def _watch():
+    # Picks up cancellations requested by other processes (API vs. workers)
+    while True:
+        with _tokens_lock:
+            tokens = list(_tokens.values())
+        for t in tokens:
+            if not t.cancelled and os.path.exists(cancel_flag_path(t.video_id)):
+                t.cancel()
+        time.sleep(WATCH_INTERVAL)
+
+def register(video_id) -> CancelToken:
+    global _watcher
+    with _tokens_lock:
+        tok = _tokens.get(video_id)
+        if tok is None:
+            tok = _tokens[video_id] = CancelToken(video_id)
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, name="cancel-watch", daemon=True)
+            _watcher.start()
+    if os.path.exists(cancel_flag_path(video_id)):
+        tok.cancel()
+    return tok
+
+def release(video_id):
+    with _tokens_lock:
+        _tokens.pop(video_id, None)
+
+def request_cancel(video_id):
+    """Cancel a job wherever it runs: flag file for other processes, token here."""
+    with open(cancel_flag_path(video_id), "w"):
+        pass
+    with _tokens_lock:
+        tok = _tokens.get(video_id)
+    if tok:
+        tok.cancel()
+    return tok is not None
+
+def clear_cancel(video_id):
+    """Remove the cancel flag once the job has settled."""
+    try:
+        os.remove(cancel_flag_path(video_id))
+    except FileNotFoundError:
+        pass
+
+def bind(token):
+    """Make `token` the current thread's token (None to unbind)."""
+    _local.token = token
+
+def current():
+    return getattr(_local, "token", None)
+
+def check():
+    tok = current()
+    if tok:
+        tok.check()
+
+# ---------------- governor ----------------
+
+class _Pool:
+    """Caps concurrent processes of one kind; waiters are served round-robin by job."""
+
+    def __init__(self, kind, limit, lock_dir=None):
+        self.kind, self.limit, self.lock_dir = kind, max(1, int(limit)), lock_dir
+        self._cond = threading.Condition()
+        self._waiting = OrderedDict()  # job -> deque[Event]
+        self._busy = 0
+        self._t0 = self._last = time.monotonic()
+        self._busy_seconds = 0.0
+        self._acquired = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _account(self):  # under lock
+        now = time.monotonic()
+        self._busy_seconds += self._busy * (now - self._last)
+        self._last = now
+
+    def _dispatch(self):  # under lock
+        while self._busy < self.limit and self._waiting:
+            job, q = next(iter(self._waiting.items()))
+            ticket = q.popleft()
+            if q:
+                self._waiting.move_to_end(job)
+            else:
+                del self._waiting[job]
+            self._account()
+            self._busy += 1
+            ticket.set()
+
+    def acquire(self, tok):
+        t0 = time.monotonic()
+        ticket = threading.Event()
+        job = tok.video_id if tok else None
+        with self._cond:
+            self._waiting.setdefault(job, deque()).append(ticket)
+            self._dispatch()
+        while not ticket.wait(0.2):
+            if tok and tok.cancelled:
+                with self._cond:
+                    q = self._waiting.get(job)
+                    if not ticket.is_set() and q is not None:
+                        q.remove(ticket)
+                        if not q:
+                            del self._waiting[job]
+                if ticket.is_set():
+                    self.release(None)
+                tok.check()
+        try:
+            fd = self._lock_slot(tok)
+        except BaseException:
+            self.release(None)
+            raise
+        waited = time.monotonic() - t0
+        with self._cond:
+            self._acquired += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return fd
+
+    def _lock_slot(self, tok):
+        # Host-wide cap: hold one of `limit` flock'd slot files for the run
+        if fcntl is None or not self.lock_dir:
+            return None
+        os.makedirs(self.lock_dir, exist_ok=True)
+        while True:
+            for i in range(self.limit):
+                fd = os.open(os.path.join(self.lock_dir, f"{self.kind}.{i}.lock"), os.O_RDWR | os.O_CREAT, 0o666)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except OSError:
+                    os.close(fd)
+            if tok:
+                tok.check()
+            time.sleep(0.05)
+
+    def release(self, fd):
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        with self._cond:
+            self._account()
+            self._busy -= 1
+            self._dispatch()
+
+    def stats(self):
+        with self._cond:
+            self._account()
+            elapsed = max(self._last - self._t0, 1e-9)
+            return {
+                "limit": self.limit,
+                "in_use": self._busy,
+                "waiting": sum(len(q) for q in self._waiting.values()),
+                "acquired": self._acquired,
+                "wait_avg_ms": round(1000 * self._wait_total / self._acquired, 2) if self._acquired else 0.0,
+                "wait_max_ms": round(1000 * self._wait_max, 2),
+                "utilization": round(self._busy_seconds / (self.limit * elapsed), 4),
+            }
+
+_pools = {}
+_pool_limits = {"ffmpeg": 2, "ffprobe": 4, "tesseract": 4}
+_lock_dir = None
+_pools_lock = threading.Lock()
+
+def configure(config):
+    global _lock_dir
+    _pool_limits.update(config.get("PROC_LIMITS", {}))
+    _lock_dir = config.get("PROC_LOCK_DIR")
+    with _pools_lock:
+        _pools.clear()
+
+def _pool(kind):
+    with _pools_lock:
+        p = _pools.get(kind)
+        if p is None and kind in _pool_limits:
+            p = _pools[kind] = _Pool(kind, _pool_limits[kind], _lock_dir)
+        return p
+
+def stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {p.kind: p.stats() for p in pools}
+
+# ---------------- running ----------------
+
+def run(cmd, capture=False):
+    """
+    Run `cmd` in its own process group under the governor, killable via the
+    current token. Returns stdout bytes when `capture`; raises
+    CalledProcessError on failure and JobCancelled if the job was cancelled
+    while it waited or ran.
+    """
+    tok = current()
+    if tok:
+        tok.check()
+    pool = _pool(os.path.basename(cmd[0]).split(".")[0])
+    slot = pool.acquire(tok) if pool else None
+    try:
+        p = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        if tok:
+            tok.attach(p)
+        try:
+            out, _ = p.communicate()
+        finally:
+            if tok:
+                tok.detach(p)
+    finally:
+        if pool:
+            pool.release(slot)
+    if tok:
+        tok.check()
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd)
+    return out
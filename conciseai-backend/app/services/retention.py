@@ -0,0 +1,187 @@
+"""
+Disk-quota driven garbage collection for MEDIA_ROOT.
+
+A background thread re-measures a few videos per tick (size, evictable
+bytes, last access) so a full pass over a large library is spread out, and
+whenever the measured total exceeds DISK_QUOTA_BYTES it evicts evictable
+artifacts from the least recently accessed videos first.
+
+Evictable: masters and intermediates that nothing reads any more, i.e.
+leftovers of interrupted transfers and writes (*.part, journal *.compact,
+tempfile "tmp*" files) and loose frames of a window whose frames/<i>.pack
+was written. Candidate frames and extracted audio never persist under
+MEDIA_ROOT (they live in temp dirs for the length of a window), so there is
+nothing else to regenerate. Summaries, keyframes, transcripts and state are
+always kept. Videos whose job is queued or running are never touched. With
+a remote blob store an evicted master is simply fetched again if the video
+is ever reprocessed.
+
+A resumable upload session that never got a job (no video.json) and hasn't
+changed for UPLOAD_SESSION_IDLE_SECONDS is abandoned: its whole directory
+is evictable.
+"""
+
+import os, shutil, threading, time, logging
+from app.services import storage, uploads
+
+log = logging.getLogger(__name__)
+
+def _evictable(vdir, root, name):
+    if root == vdir and name.startswith("master."):
+        return True
+    if name.endswith((".part", ".compact")) or (name.startswith("tmp") and "." not in name):
+        return True
+    # frames/<i>/* left behind after frames/<i>.pack was written
+    parent = os.path.dirname(root)
+    return os.path.basename(parent) == "frames" and os.path.exists(root + ".pack")
+
+def _abandoned(vdir, session_idle):
+    """An upload session without a job whose files haven't changed for session_idle seconds."""
+    if session_idle is None or os.path.exists(os.path.join(vdir, "video.json")):
+        return False
+    try:
+        newest = max(os.path.getmtime(os.path.join(vdir, name)) for name in os.listdir(vdir))
+    except (FileNotFoundError, ValueError):
+        return False
+    return os.path.exists(os.path.join(vdir, "upload.json")) and time.time() - newest > session_idle
+
+def _measure(video_id, session_idle=None):
+    vdir = storage.video_dir(video_id)
+    abandoned = _abandoned(vdir, session_idle)
+    size, evictable = 0, []
+    for root, _, files in os.walk(vdir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                n = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            size += n
+            if abandoned or _evictable(vdir, root, name):
+                evictable.append((path, n))
+    return {"size": size, "evictable": evictable, "last_access": storage.last_access(video_id)}
+
+class Retention:
+    def __init__(self, quota_bytes, batch=20, session_idle=None):
+        self.quota = quota_bytes
+        self.batch = batch
+        self.session_idle = session_idle
+        self._usage = {}
+        self._seen = set()
+        self._ids = None
+        self._lock = threading.Lock()
+        self.evicted_bytes = 0
+        self.evicted_files = 0
+
+    def tick(self):
+        """Measure the next batch of videos, then enforce the quota."""
+        if self._ids is None:
+            self._ids, self._seen = storage.iter_video_ids(), set()
+        for _ in range(self.batch):
+            vid = next(self._ids, None)
+            if vid is None:
+                self._ids = None
+                with self._lock:  # full pass done: forget deleted videos
+                    for gone in set(self._usage) - self._seen:
+                        del self._usage[gone]
+                break
+            self._seen.add(vid)
+            u = _measure(vid, self.session_idle)
+            with self._lock:
+                self._usage[vid] = u
+        self.enforce()
+
+    def enforce(self):
+        with self._lock:
+            total = sum(u["size"] for u in self._usage.values())
+            if total <= self.quota:
+                return
+            lru = sorted(
+                (vid for vid, u in self._usage.items() if u["evictable"]),
+                key=lambda vid: self._usage[vid]["last_access"],
+            )
+        for vid in lru:
+            if total <= self.quota:
+                break
+            total -= self._evict(vid)
+
+    def _evict(self, video_id):
+        v = storage.read_video_state(video_id)
+        if v is None:
+            return self._drop_session(video_id)
+        # "stalled": ingest resumes if the upload is completed, and needs the master
+        if not v or v.get("status") in storage.ACTIVE_STATUSES + ("stalled",):
+            return 0
+        with self._lock:
+            u = self._usage.get(video_id)
+            files, u["evictable"] = (u["evictable"], []) if u else ([], [])
+        freed, masters = 0, 0
+        for path, n in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            freed += n
+            masters += os.path.basename(path).startswith("master.")
+            self.evicted_files += 1
+        if freed:
+            self.evicted_bytes += freed
+            with self._lock:
+                if video_id in self._usage:
+                    self._usage[video_id]["size"] -= freed
+            if masters:
+                storage.write_video_state(dict(v, master_evicted=True))
+            log.info("evicted %d bytes from %s", freed, video_id)
+        return freed
+
+    def _drop_session(self, video_id):
+        vdir = storage.video_dir(video_id)
+        # Under the session lock, so a chunk or complete that comes in now
+        # either lands first (and the session is no longer idle) or gets a 404
+        with uploads.locked(video_id) as s:
+            if s is None or not _abandoned(vdir, self.session_idle):
+                return 0
+            shutil.rmtree(vdir, ignore_errors=True)
+        with self._lock:
+            u = self._usage.pop(video_id, None)
+        freed = u["size"] if u else 0
+        self.evicted_bytes += freed
+        self.evicted_files += len(u["evictable"]) if u else 0
+        log.info("deleted upload session %s, idle for over %d s", video_id, self.session_idle)
+        return freed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "quota_bytes": self.quota,
+                "tracked_videos": len(self._usage),
+                "used_bytes": sum(u["size"] for u in self._usage.values()),
+                "evicted_bytes": self.evicted_bytes,
+                "evicted_files": self.evicted_files,
+            }
+
+_service = None
+
+def start(config):
+    """Start the background collector if DISK_QUOTA_BYTES is set."""
+    global _service
+    quota = config.get("DISK_QUOTA_BYTES")
+    if not quota or _service is not None:
+        return None
+    _service = Retention(int(quota), batch=config.get("RETENTION_BATCH", 20),
+                         session_idle=config.get("UPLOAD_SESSION_IDLE_SECONDS"))
+    interval = config.get("RETENTION_INTERVAL_SECONDS", 5)
+
+    def loop():
+        while True:
+            try:
+                _service.tick()
+            except Exception:
+                log.exception("retention tick failed")
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="retention", daemon=True).start()
+    return _service
+
+def stats():
+    return _service.stats() if _service else None
@@ -0,0 +1,114 @@
+"""
+Per-job state manager.
+
+While a job runs, its video.json and window JSONs are owned by one JobState
+that keeps them in memory. Progress updates only touch memory; files are
+written through at checkpoints (window phases listed in STATE_CHECKPOINTS,
+any terminal window status, and every video-level change). The files are
+never read back while owned, and every write is still an atomic
+tempfile+rename, so readers always see a complete document.
+"""
+
+import copy, threading
+from app.services import storage
+
+_checkpoints = {"start"}
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def configure(config):
+    global _checkpoints
+    _checkpoints = set(config.get("STATE_CHECKPOINTS", _checkpoints))
+
+class JobState:
+    def __init__(self, video_id, video):
+        self.video_id = video_id
+        self.video = video
+        self._windows = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _bump(self):  # under lock
+        # Monotonic per-video write counter; written windows record the value
+        # they were written at so listings can ask for "changed since N"
+        self.video["version"] = self.video.get("version", 0) + 1
+        return self.video["version"]
+
+    def _write_window(self, idx, wstate):  # under lock
+        wstate["version"] = self._bump()
+        self.video["windows"][idx]["version"] = wstate["version"]
+        storage.write_window_state(self.video_id, idx, wstate)
+
+    def save_video(self):
+        with self._lock:
+            self._bump()
+            storage.write_video_state(self.video)
+
+    def update_video(self, windows=(), **fields):
+        """Set video-level fields, append window briefs, and write through."""
+        with self._lock:
+            self.video.update(fields)
+            self.video.setdefault("windows", []).extend(windows)
+            self._bump()
+            storage.write_video_state(self.video)
+
+    def put_window(self, idx, wstate, phase):
+        """Record a window update; write through if `phase` is a checkpoint."""
+        brief = {
+            "id": wstate["id"],
+            "index": idx,
+            "t_start": wstate["t_start"],
+            "t_end": wstate["t_end"],
+            "status": wstate["status"]
+        }
+        with self._lock:
+            self._windows[idx] = wstate
+            wins = self.video.setdefault("windows", [])
+            # Keep windows[] ordered by index
+            while len(wins) < idx:
+                wins.append({"id": f"w_{len(wins):03d}", "index": len(wins), "status": "skipped"})
+            # Until the next write the brief carries the version of the file on
+            # disk (0: none yet), so paged listings can trust the briefs
+            brief["version"] = wins[idx].get("version", 0) if idx < len(wins) else 0
+            if len(wins) == idx:
+                wins.append(brief)
+            else:
+                wins[idx] = brief
+            if wstate["status"] == "processing" and phase not in _checkpoints:
+                self._dirty.add(idx)
+                return
+            # Each window dict is only mutated by the thread that calls us for
+            # it, so it is safe to serialize here.
+            self._write_window(idx, wstate)
+            self._dirty.discard(idx)
+            storage.write_video_state(self.video)
+
+    def flush(self):
+        with self._lock:
+            for idx in sorted(self._dirty):
+                self._write_window(idx, self._windows[idx])
+            self._dirty.clear()
+            self._bump()
+            storage.write_video_state(self.video)
+
+def open(video_id):
+    """The job's JobState, loading video.json once. None if the video is unknown."""
+    with _jobs_lock:
+        js = _jobs.get(video_id)
+        if js is None:
+            v = storage.read_video_state(video_id)
+            if not v:
+                return None
+            v = copy.deepcopy(v)  # owned from here on
+            js = _jobs[video_id] = JobState(video_id, v)
+        return js
+
+def get(video_id):
+    with _jobs_lock:
+        return _jobs.get(video_id)
+
+def close(video_id):
+    with _jobs_lock:
+        js = _jobs.pop(video_id, None)
+    if js:
+        js.flush()
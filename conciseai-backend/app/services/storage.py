@@ -1,56 +1,474 @@
-import os, json, uuid, tempfile
-from flask import current_app, send_file
+import os, json, uuid, tempfile, threading, time, hashlib
+from collections import OrderedDict
+
+_media_root = None
+_media_url = "/media"
+_backend = "json"
+_blobs = None
+_pack_frames = False
+_layout = "sharded"
+
+# Read-through cache of parsed JSON documents: path -> (stat key, doc).
+# An entry is valid while the file's (mtime_ns, size, inode) is unchanged;
+# in-process writes drop it outright. A hit costs one stat.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_max = 512
+_cache_hits = 0
+_cache_misses = 0
+# Write generation per recently written path, so a read that overlapped a
+# write doesn't cache what it read (the stat key alone can repeat: coarse
+# mtimes, reused inodes). Bounded: paths evicted from it count as written
+# at _evicted_gen.
+_gen = 0
+_versions = OrderedDict()
+_evicted_gen = 0
+
+# Statuses after which nothing writes a video again; the sqlite and journal
+# backends export their JSON files at that point
+TERMINAL_STATUSES = ("done", "done_with_errors", "failed", "cancelled")
+# Statuses of a video whose job is waiting or running
+ACTIVE_STATUSES = ("ingesting", "queued", "processing")
+
+def configure(config):
+    """Bind storage to a config mapping so it works without a Flask app context."""
+    global _media_root, _media_url, _backend, _cache_max, _blobs, _pack_frames, _layout
+    _media_root = config["MEDIA_ROOT"]
+    _pack_frames = bool(config.get("PACK_FRAMES", False))
+    _layout = config.get("MEDIA_LAYOUT", "sharded")
+    _sharded_dirs.clear()
+    _media_url = config.get("MEDIA_URL", _media_url)
+    from app.services import blobs as blobsvc
+    _blobs = blobsvc.from_config(config, _media_root, media_path)
+    _backend = config.get("STATE_BACKEND", "json")
+    _cache_max = config.get("STATE_CACHE_SIZE", _cache_max)
+    if _backend == "journal":
+        from app.services import journal
+        os.makedirs(_media_root, exist_ok=True)
+        journal.CACHE_SIZE = config.get("JOURNAL_CACHE_SIZE", journal.CACHE_SIZE)
+    if _backend == "sqlite":
+        from app.services import metastore
+        os.makedirs(_media_root, exist_ok=True)
+        metastore.configure(config.get("SQLITE_PATH") or os.path.join(_media_root, "state.sqlite3"))
+
+def backend():
+    return _backend
 
 def media_root():
-    return current_app.config["MEDIA_ROOT"]
+    if _media_root is None:
+        from flask import current_app
+        return current_app.config["MEDIA_ROOT"]
+    return _media_root
+
+def blobs():
+    global _blobs
+    if _blobs is None:
+        from app.services import blobs as blobsvc
+        _blobs = blobsvc.LocalBlobStore(media_root(), media_path)
+    return _blobs
+
+def media_key(uri_or_path):
+    """
+    Blob key for a /media URI or a local path under MEDIA_ROOT. Keys are
+    logical ("videos/<id>/..."), whatever the on-disk layout.
+    """
+    prefix = _media_url.rstrip("/") + "/"
+    if uri_or_path.startswith(prefix):
+        return uri_or_path[len(prefix):]
+    parts = os.path.relpath(uri_or_path, media_root()).split(os.sep)
+    if len(parts) >= 4 and parts[0] == "videos" and _is_shard(parts[1]) and _is_shard(parts[2]):
+        parts = ["videos"] + parts[3:]
+    return "/".join(parts)
+
+def media_path(uri_or_key):
+    """Local path for a /media URI or blob key."""
+    prefix = _media_url.rstrip("/") + "/"
+    if uri_or_key.startswith(prefix):
+        uri_or_key = uri_or_key[len(prefix):]
+    parts = uri_or_key.split("/")
+    if len(parts) >= 2 and parts[0] == "videos":
+        return os.path.join(video_dir(parts[1]), *parts[2:])
+    return os.path.join(media_root(), *parts)
+
+def publish_artifacts(uris_or_paths):
+    """Push finished local artifacts to the blob store (no-op for local)."""
+    keys = [media_key(u) for u in uris_or_paths if u]
+    blobs().put_many((k, media_path(k)) for k in keys)
+
+def ensure_local(path):
+    """Fetch an artifact (e.g. a master uploaded on another host) if it isn't on disk."""
+    if not os.path.exists(path):
+        blobs().fetch(media_key(path), path)
+    return path
+
+def pack_frames_enabled():
+    return _pack_frames
+
+def pack_window_frames(video_id, index, fdir, names):
+    """
+    Replace a window's frame directory with frames/<index>.pack. Returns
+    (pack URI, {name: [offset, length]}); frame URIs keep resolving through
+    the /media route.
+    """
+    from app.services import packs
+    pack_path = os.path.join(video_dir(video_id), "frames", f"{index}.pack")
+    idx = packs.write_pack(pack_path, [(n, os.path.join(fdir, n)) for n in names])
+    for n in os.listdir(fdir):
+        os.remove(os.path.join(fdir, n))
+    os.rmdir(fdir)
+    return f"{_media_url}/videos/{video_id}/frames/{index}.pack", idx
+
+_pack_indexes = OrderedDict()
+
+def _packed_frame(filename):
+    """Bytes of videos/<id>/frames/<i>/<name> from frames/<i>.pack, or None."""
+    parts = filename.split("/")
+    if len(parts) != 5 or parts[0] != "videos" or parts[2] != "frames":
+        return None
+    pack_key = "/".join(parts[:3] + [parts[3] + ".pack"])
+    local = media_path(pack_key)
+    if not (_pack_frames or os.path.exists(local)):
+        return None
+    from app.services import packs
+    store = blobs()
+    try:
+        stamp = os.path.getmtime(local) if os.path.exists(local) else None
+        with _cache_lock:
+            hit = _pack_indexes.get(pack_key)
+        if not hit or hit[0] != stamp:
+            hit = (stamp, packs.parse_header(lambda o, n: store.read_range(pack_key, o, n)))
+            with _cache_lock:
+                _pack_indexes[pack_key] = hit
+                while len(_pack_indexes) > _cache_max:
+                    _pack_indexes.popitem(last=False)
+        entry = hit[1].get(parts[4])
+        if entry is None:
+            return None
+        return store.read_range(pack_key, entry[0], entry[1])
+    except (FileNotFoundError, ValueError):
+        return None
+
+def media_response(filename):
+    """
+    Response for GET /media/<filename>: a local file (range requests
+    supported, so packs can be read piecewise), a frame looked up inside its
+    window pack, or a presigned redirect for remote blob stores.
+    """
+    from flask import Response, abort, redirect, send_from_directory
+    from werkzeug.security import safe_join
+    if safe_join(media_root(), filename) is None:
+        abort(404)
+    parts = filename.split("/")
+    if len(parts) > 1 and parts[0] == "videos":
+        touch_access(parts[1])
+    if not os.path.exists(media_path(filename)):
+        data = _packed_frame(filename)
+        if data is not None:
+            resp = Response(data, mimetype="image/jpeg")
+            resp.headers["Cache-Control"] = "public, max-age=86400"
+            return resp
+    url = blobs().url(filename)
+    if url:
+        return redirect(url, code=302)
+    # Logical "videos/<id>/..." names map onto the on-disk layout
+    path = media_path(filename)
+    return send_from_directory(os.path.dirname(path), os.path.basename(path))
 
 def new_id(prefix="v"):
     return f"{prefix}_{uuid.uuid4().hex[:8]}"
 
-def _atomic_write_json(path, data):
+def _atomic_write_json(path, data, indent=2):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
     with os.fdopen(fd, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+        if indent is None:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
     os.replace(tmp, path)
+    global _gen, _evicted_gen
+    with _cache_lock:
+        _gen += 1
+        _versions[path] = _gen
+        _versions.move_to_end(path)
+        while len(_versions) > 2 * _cache_max:
+            _, _evicted_gen = _versions.popitem(last=False)
+        _cache.pop(path, None)
 
 def read_json(path):
+    """
+    Parsed JSON at `path` (None if missing), served from the LRU cache when
+    the file is unchanged. The result is shared: copy it before mutating.
+    """
+    global _cache_hits, _cache_misses
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        with _cache_lock:
+            _cache.pop(path, None)
+        return None
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _cache_lock:
+        start = _gen
+        hit = _cache.get(path)
+        if hit and hit[0] == key:
+            _cache.move_to_end(path)
+            _cache_hits += 1
+            return hit[1]
+        _cache_misses += 1
     try:
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            doc = json.load(f)
     except FileNotFoundError:
         return None
+    with _cache_lock:
+        if _versions.get(path, _evicted_gen) <= start:  # not written since we started
+            _cache[path] = (key, doc)
+            _cache.move_to_end(path)
+            while len(_cache) > _cache_max:
+                _cache.popitem(last=False)
+    return doc
 
-def video_dir(video_id):
+def cache_stats():
+    with _cache_lock:
+        total = _cache_hits + _cache_misses
+        return {
+            "size": len(_cache),
+            "max": _cache_max,
+            "hits": _cache_hits,
+            "misses": _cache_misses,
+            "hit_ratio": round(_cache_hits / total, 4) if total else 0.0,
+        }
+
+# Layout under MEDIA_ROOT/videos:
+#   sharded  videos/ab/cd/<id>   ab/cd = first 4 hex digits of sha1(id)
+#   flat     videos/<id>         (legacy; still found by lookups)
+# Lookups cost at most two stats and sharded hits are memoized (LRU), since
+# migration only ever moves flat → sharded. A migrated video's flat path is
+# left as a symlink to its new directory, so a path computed before the move
+# still leads there (and nothing recreates the old directory); listings
+# skip those links.
+_sharded_dirs = OrderedDict()
+_memo_lock = threading.Lock()
+MEMO_MAX = 10000  # videos remembered by each memo
+
+def _memo_get(memo, key):
+    with _memo_lock:
+        value = memo.get(key)
+        if value is not None:
+            memo.move_to_end(key)
+        return value
+
+def _memo_put(memo, key, value):
+    with _memo_lock:
+        memo[key] = value
+        memo.move_to_end(key)
+        while len(memo) > MEMO_MAX:
+            memo.popitem(last=False)
+
+def _is_shard(name):
+    return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
+
+def sharded_video_dir(video_id):
+    h = hashlib.sha1(video_id.encode("utf-8")).hexdigest()
+    return os.path.join(media_root(), "videos", h[:2], h[2:4], video_id)
+
+def legacy_video_dir(video_id):
     return os.path.join(media_root(), "videos", video_id)
 
+def video_dir(video_id):
+    d = _memo_get(_sharded_dirs, video_id)
+    if d:
+        return d
+    sharded = sharded_video_dir(video_id)
+    if os.path.isdir(sharded):
+        _memo_put(_sharded_dirs, video_id, sharded)
+        return sharded
+    legacy = legacy_video_dir(video_id)
+    if _layout == "flat" or os.path.isdir(legacy):
+        return legacy
+    return sharded  # new video
+
+def iter_video_ids():
+    """Lazily yield every video id under MEDIA_ROOT (both layouts)."""
+    vroot = os.path.join(media_root(), "videos")
+    def walk():
+        try:
+            top = list(os.scandir(vroot))
+        except FileNotFoundError:
+            return
+        for e in top:
+            if not e.is_dir(follow_symlinks=False):  # a migrated video's old path
+                continue
+            if not _is_shard(e.name):
+                yield e.name
+                continue
+            for mid in os.scandir(e.path):
+                if mid.is_dir():
+                    for v in os.scandir(mid.path):
+                        if v.is_dir():
+                            yield v.name
+    return walk()
+
+def iter_legacy_video_ids():
+    vroot = os.path.join(media_root(), "videos")
+    try:
+        return [e.name for e in os.scandir(vroot) if e.is_dir(follow_symlinks=False) and not _is_shard(e.name)]
+    except FileNotFoundError:
+        return []
+
+_access_touched = OrderedDict()  # video_id -> last utime (LRU, see _memo_put)
+ACCESS_TOUCH_SECONDS = 60
+
+def touch_access(video_id):
+    """Record a read of the video (throttled to one utime per minute per process)."""
+    now = time.time()
+    if now - (_memo_get(_access_touched, video_id) or 0) < ACCESS_TOUCH_SECONDS:
+        return
+    _memo_put(_access_touched, video_id, now)
+    path = os.path.join(video_dir(video_id), ".access")
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        if os.path.isdir(video_dir(video_id)):
+            open(path, "a").close()
+
+def last_access(video_id):
+    for name in (".access", "video.json"):
+        try:
+            return os.path.getmtime(os.path.join(video_dir(video_id), name))
+        except FileNotFoundError:
+            pass
+    return 0.0
+
 def video_json_path(video_id):
     return os.path.join(video_dir(video_id), "video.json")
 
-def init_video_state(video_id, filename, duration_sec, window_seconds):
+def init_video_state(video_id, filename, duration_sec, window_seconds, window_planner="fixed", window_tolerance_sec=0, **extra):
     vdir = video_dir(video_id)
     os.makedirs(vdir, exist_ok=True)
     state = {
         "id": video_id,
         "filename": filename,
-        "status": "processing",
+        "status": "queued",
         "duration_sec": duration_sec,
         "window_seconds": window_seconds,
-        "windows": []
+        "window_planner": window_planner,
+        "window_tolerance_sec": window_tolerance_sec,
+        "windows": [],
+        **extra
     }
-    _atomic_write_json(video_json_path(video_id), state)
+    write_video_state(state)
     return state
 
+def save_media_info(video_id, media):
+    """
+    A mediaio.probe() result as kept in video.json. The keyframe index can
+    run to thousands of entries, so it goes to keyframes.json beside it
+    rather than into every rewrite of the video document.
+    """
+    keyframes = media.get("keyframes", [])
+    _atomic_write_json(os.path.join(video_dir(video_id), "keyframes.json"), {"keyframes": keyframes}, indent=None)
+    return dict(media, keyframes={"count": len(keyframes), "uri": f"/media/videos/{video_id}/keyframes.json"})
+
+def read_video_state(video_id):
+    """Current video document. May be shared with a cache: copy before mutating."""
+    if _backend == "sqlite":
+        from app.services import metastore
+        return metastore.get_video(video_id)
+    if _backend == "journal":
+        from app.services import journal
+        v, _ = journal.snapshot(video_id)
+        return v
+    return read_json(video_json_path(video_id))
+
+def state_version(video_id):
+    """
+    Opaque token that changes whenever the video or any of its windows
+    changes (every window write is followed by a video write). Costs one stat
+    or one indexed lookup, never a document read. None if the video is unknown.
+    """
+    if _backend == "sqlite":
+        from app.services import metastore
+        v = metastore.video_version(video_id)
+        return None if v is None else str(v)
+    if _backend == "journal":
+        from app.services import journal
+        path = journal.journal_path(video_id)
+    else:
+        path = video_json_path(video_id)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+
+def record_event(video_id, payload):
+    """Journal a published event (journal backend only); tags it with its seq."""
+    if _backend == "journal":
+        from app.services import journal
+        payload["seq"] = journal.append(video_id, {"k": "event", "payload": payload})
+
+# State documents are rewritten often; keep them compact
 def write_video_state(state):
-    _atomic_write_json(video_json_path(state["id"]), state)
+    if _backend == "sqlite":
+        from app.services import metastore
+        metastore.put_video(state)
+        if state.get("status") in TERMINAL_STATUSES:
+            export_json(state["id"])
+    elif _backend == "journal":
+        from app.services import journal
+        journal.append(state["id"], {"k": "video", "doc": state})
+        if state.get("status") in TERMINAL_STATUSES:
+            export_json(state["id"])
+            journal.compact(state["id"])
+    else:
+        _atomic_write_json(video_json_path(state["id"]), state, indent=None)
+    _mark_active(state["id"], state.get("status") in ACTIVE_STATUSES)
+
+# Videos whose job is waiting or running, as empty files under
+# MEDIA_ROOT/active kept by write_video_state, so live views don't read the
+# whole library. Entries can outlive a deleted video: check the status.
+def _mark_active(video_id, active):
+    path = os.path.join(media_root(), "active", video_id)
+    if active:
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "a").close()
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def iter_active_video_ids():
+    try:
+        return os.listdir(os.path.join(media_root(), "active"))
+    except FileNotFoundError:
+        return []
 
 def window_json_path(video_id, index):
     return os.path.join(video_dir(video_id), "windows", f"{index}.json")
 
 def write_window_state(video_id, index, data):
-    _atomic_write_json(window_json_path(video_id, index), data)
+    if _backend == "sqlite":
+        from app.services import metastore
+        metastore.put_window(video_id, index, data)
+        return
+    if _backend == "journal":
+        from app.services import journal
+        journal.append(video_id, {"k": "window", "i": index, "doc": data})
+        return
+    _atomic_write_json(window_json_path(video_id, index), data, indent=None)
 
 def list_windows(video_id):
+    if _backend == "sqlite":
+        from app.services import metastore
+        return metastore.list_windows(video_id)
+    if _backend == "journal":
+        from app.services import journal
+        _, wins = journal.snapshot(video_id)
+        return [wins[i] for i in sorted(wins)]
     wdir = os.path.join(video_dir(video_id), "windows")
     if not os.path.isdir(wdir): return []
     out = []
@@ -58,3 +476,55 @@ def list_windows(video_id):
         w = read_json(os.path.join(wdir, name))
         if w: out.append(w)
     return out
+
+def _select(w, fields):
+    return {k: w[k] for k in fields if k in w} if fields else w
+
+def _matches(w, status, since_version):
+    return (not status or w.get("status") in status) and \
+        (since_version is None or w.get("version", 0) > since_version)
+
+def query_windows(video_id, offset=0, limit=None, status=None, since_version=None, fields=None):
+    """
+    One page of a video's windows: (total matching, [docs]). `status` is a
+    set of statuses, `since_version` keeps windows written after that video
+    version, `fields` trims each doc (index is always kept). Window documents
+    outside the page are not loaded.
+    """
+    if fields:
+        fields = ["index"] + [f for f in fields if f != "index"]
+    end = None if limit is None else offset + limit
+    if _backend == "sqlite":
+        from app.services import metastore
+        total, docs = metastore.query_windows(video_id, offset, limit, status, since_version)
+        return total, [_select(w, fields) for w in docs]
+    if _backend == "journal":
+        from app.services import journal
+        _, wins = journal.snapshot(video_id)
+        hits = [wins[i] for i in sorted(wins) if _matches(wins[i], status, since_version)]
+        return len(hits), [_select(w, fields) for w in hits[offset:end]]
+
+    # json: filter on the brief list in video.json (status + version per
+    # window), then read only the page's window files
+    v = read_json(video_json_path(video_id)) or {}
+    briefs = [b for b in v.get("windows", []) if "version" in b]
+    if any(b.get("status") not in ("pending", "skipped") and "version" not in b for b in v.get("windows", [])):
+        # written before windows carried versions: scan the files
+        hits = [w for w in list_windows(video_id) if _matches(w, status, since_version)]
+        return len(hits), [_select(w, fields) for w in hits[offset:end]]
+    hits = [b for b in briefs if _matches(b, status, since_version)]
+    page = []
+    for b in hits[offset:end]:
+        w = read_json(window_json_path(video_id, b["index"]))
+        if w:
+            page.append(_select(w, fields))
+    return len(hits), page
+
+def export_json(video_id):
+    """Write the backend state of a video out as video.json + windows/*.json."""
+    v = read_video_state(video_id)
+    if v is None:
+        return
+    for w in list_windows(video_id):
+        _atomic_write_json(window_json_path(video_id, w["index"]), w)
+    _atomic_write_json(video_json_path(video_id), v)
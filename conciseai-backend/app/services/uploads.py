@@ -0,0 +1,238 @@
+"""
+Resumable upload sessions.
+
+A session is a video directory holding upload.json and the master file the
+chunks are appended to; there is no separate spool. The master's size on
+disk is the session offset, so a chunk cut off mid-way resumes from the last
+byte that actually landed. The SHA-256 is computed as chunks arrive; a
+process that didn't see the earlier chunks (restart, another worker) catches
+up by hashing the prefix from disk once. The container is sniffed from the
+first chunk, so a file that isn't a video is turned away before it lands.
+
+Receiver does the same for a one-shot multipart upload (POST /videos).
+"""
+
+import hashlib, os, threading, time
+from contextlib import contextmanager
+from app.services import storage, mediaio
+from app.utils.errors import UploadConflict, UnsupportedMedia
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CHUNK_READ_BYTES = 1024 * 1024
+
+_hashers = {}  # video_id -> [sha256, bytes hashed]
+_hashers_lock = threading.Lock()
+
+class Receiver:
+    """
+    Write-through file for a request body: bytes go straight to `path` while
+    their SHA-256, size and container are worked out, so neither the hash
+    nor the sniff reads the file back. write() raises UnsupportedMedia as
+    soon as the head isn't a container we process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.container = None
+        self._f = open(path, "w+b")
+        self._sha = hashlib.sha256()
+        self._head = b""
+
+    def write(self, buf):
+        if self.container is None:
+            self._head += buf[:mediaio.SNIFF_MIN_BYTES]
+            if len(self._head) >= mediaio.SNIFF_MIN_BYTES:
+                self.container = _sniff(self._head)
+        self._sha.update(buf)
+        self.size += len(buf)
+        return self._f.write(buf)
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def read(self, *args):
+        return self._f.read(*args)
+
+    def close(self):
+        self._f.close()
+
+    def finish(self):
+        """Flush to disk and return (sha256 hex, size, container)."""
+        if self.container is None:
+            raise UnsupportedMedia("file too short to be a video")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        return self._sha.hexdigest(), self.size, self.container
+
+def _sniff(head):
+    container = mediaio.sniff_container(head)
+    if container is None:
+        raise UnsupportedMedia("not a recognized video container")
+    return container
+
+def _session_path(video_id):
+    return os.path.join(storage.video_dir(video_id), "upload.json")
+
+def get(video_id):
+    """The session document with its current offset, or None."""
+    s = storage.read_json(_session_path(video_id))
+    if s is None:
+        return None
+    s = dict(s, master_path=os.path.join(storage.video_dir(video_id), s["master"]))
+    try:
+        s["offset"] = os.path.getsize(s["master_path"])
+    except FileNotFoundError:
+        s["offset"] = 0
+    return s
+
+def create(filename, size=None):
+    video_id = storage.new_id("v")
+    vdir = storage.video_dir(video_id)
+    os.makedirs(vdir, exist_ok=True)
+    master_path = os.path.join(vdir, "master." + filename.rsplit(".", 1)[-1].lower())
+    open(master_path, "wb").close()
+    s = {"id": video_id, "filename": filename, "size": size, "master": os.path.basename(master_path),
+         "status": "uploading", "created": time.time()}
+    storage._atomic_write_json(_session_path(video_id), s)
+    return dict(s, master_path=master_path, offset=0)
+
+def _locked(f):
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise UploadConflict("another request is writing this upload", os.fstat(f.fileno()).st_size)
+
+def _hasher(video_id, f, end):
+    """The running hash of f[:end], catching up from disk if needed (f must be locked)."""
+    with _hashers_lock:
+        h = _hashers.get(video_id)
+        if h is None or h[1] > end:
+            h = _hashers[video_id] = [hashlib.sha256(), 0]
+    if h[1] < end:
+        f.seek(h[1])
+        while h[1] < end:
+            buf = f.read(min(CHUNK_READ_BYTES, end - h[1]))
+            if not buf:
+                break
+            h[0].update(buf)
+            h[1] += len(buf)
+    f.seek(end)
+    return h
+
+def write(video_id, offset, stream, max_bytes=None):
+    """
+    Append `stream` at `offset`, which must be the current offset. Returns
+    the new offset; bytes that arrived before a broken stream are kept. The
+    upload may not grow past its declared size (else `max_bytes`).
+    """
+    s = get(video_id)
+    if s is None:
+        raise KeyError(video_id)
+    if s["status"] != "uploading":
+        raise UploadConflict("upload already completed", s["offset"])
+    with open(s["master_path"], "r+b") as f:
+        _locked(f)
+        end = f.seek(0, os.SEEK_END)
+        # Re-read under the lock: finalize may have completed it meanwhile
+        s = get(video_id)
+        if s["status"] != "uploading":
+            raise UploadConflict("upload already completed", end)
+        if offset != end:
+            raise UploadConflict("chunk does not start at the upload offset", end)
+        h = _hasher(video_id, f, end)
+        limit = s["size"] if s["size"] is not None else max_bytes
+        while True:
+            buf = stream.read(CHUNK_READ_BYTES)
+            if not buf:
+                break
+            if limit is not None and end + len(buf) > limit:
+                raise UploadConflict("chunk runs past the upload size limit", end)
+            if "container" not in s and end + len(buf) >= mediaio.SNIFF_MIN_BYTES:
+                # The chunk that completes the head is checked before it lands;
+                # earlier reads of this request may still sit in f's buffer
+                f.flush()
+                s["container"] = _sniff(os.pread(f.fileno(), end, 0) + buf if end else buf)
+                doc = storage.read_json(_session_path(video_id))
+                storage._atomic_write_json(_session_path(video_id), dict(doc, container=s["container"]))
+            f.write(buf)
+            h[0].update(buf)
+            end += len(buf)
+            h[1] = end
+        f.flush()
+        os.fsync(f.fileno())
+    return end
+
+@contextmanager
+def locked(video_id):
+    """Hold the session lock (waiting out a chunk in flight); yields the session, or None."""
+    s = get(video_id)
+    if s is None:
+        yield None
+        return
+    with open(s["master_path"], "rb") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield get(video_id)
+
+def mark_ingest(video_id, then=None):
+    """
+    Record that processing started during the upload; True only for the
+    first caller. `then(session)` runs first, under the lock; the session is
+    only marked if it returns, so a failed start leaves it uploading.
+    """
+    with locked(video_id) as s:
+        if s is None or s.get("ingest") or s["status"] != "uploading":
+            return False
+        if then is not None:
+            then(s)
+        doc = {k: v for k, v in s.items() if k not in ("master_path", "offset")}
+        storage._atomic_write_json(_session_path(video_id), dict(doc, ingest=True))
+    return True
+
+def reject(video_id, reason):
+    """
+    Close an ingesting session whose finished file turned out not to be a
+    video: status "rejected" with the reason. Its job fails on the next tick.
+    """
+    with locked(video_id):
+        doc = storage.read_json(_session_path(video_id))
+        if doc is not None and doc["status"] == "uploading":
+            storage._atomic_write_json(_session_path(video_id), dict(doc, status="rejected", error=reason))
+
+def finalize(video_id, sha256=None, then=None):
+    """
+    Close the session: (master_path, sha256 hex, size). Raises UploadConflict
+    if bytes are missing or the client's checksum doesn't match. `then(session,
+    sha256)` runs once the upload checks out, still under the lock; the
+    session is only marked complete if it returns, so a failed start can be
+    retried with another finalize.
+    """
+    s = get(video_id)
+    if s is None:
+        raise KeyError(video_id)
+    with open(s["master_path"], "rb") as f:
+        _locked(f)
+        end = f.seek(0, os.SEEK_END)
+        # Re-read under the lock so two finalize calls can't both succeed
+        s = get(video_id)
+        if s["status"] != "uploading":
+            raise UploadConflict("upload already completed", end)
+        if s["size"] is not None and end != s["size"]:
+            raise UploadConflict("upload incomplete", end)
+        digest = _hasher(video_id, f, end)[0].hexdigest()
+        if sha256 and sha256.lower() != digest:
+            raise UploadConflict("sha256 mismatch", end)
+        if then is not None:
+            then(s, digest)
+        doc = {k: v for k, v in s.items() if k not in ("master_path", "offset")}
+        storage._atomic_write_json(_session_path(video_id), dict(doc, status="complete", sha256=digest))
+    with _hashers_lock:
+        _hashers.pop(video_id, None)
+    return s["master_path"], digest, end
@@ -4,3 +4,64 @@ def windows(duration_sec: int, step_sec: int):
         yield {"index": idx, "t_start": t, "t_end": min(t + step_sec, duration_sec)}
         idx += 1
         t += step_sec
+
+def _nearest(points, want, tolerance):
+    best = None
+    for p in points:
+        if abs(p - want) <= tolerance and (best is None or abs(p - want) < abs(best - want)):
+            best = p
+    return best
+
+def _tolerance(step_sec, tolerance_sec):
+    # Below half a step every cut lands at least step/2 past the last one,
+    # whatever tolerance a video was configured with
+    return min(tolerance_sec, step_sec / 2)
+
+def _cut(t, step_sec, tolerance_sec, scan):
+    want = t + step_sec
+    cut = None
+    if scan and tolerance_sec > 0:
+        scenes, silences = scan(max(t + 1, want - tolerance_sec), want + tolerance_sec)
+        cut = _nearest(scenes, want, tolerance_sec)
+        if cut is None:
+            cut = _nearest(silences, want, tolerance_sec)
+    return round(cut if cut is not None else want, 3)
+
+def plan(duration_sec: float, step_sec: float, tolerance_sec: float = 0, scan=None, prev=()):
+    """
+    Content-aware variant of `windows`: every boundary lands near
+    t_prev + step_sec but is snapped, within ±tolerance_sec, to the closest
+    slide change, else the closest silence gap, else left where it is.
+
+    `scan(t0, t1)` returns (scene_change_times, silence_midpoints) found in
+    [t0, t1); it is called once per boundary so only ~2*tolerance of every
+    window is ever scanned. The last window may run up to step + tolerance
+    rather than leaving a sliver. With `prev` (windows already planned by
+    `extend`) only the windows after them are returned. The tolerance is
+    capped at step_sec / 2.
+    """
+    tolerance_sec = _tolerance(step_sec, tolerance_sec)
+    t = prev[-1]["t_end"] if prev else 0
+    out = []
+    while duration_sec - t > step_sec + tolerance_sec:
+        cut = _cut(t, step_sec, tolerance_sec, scan)
+        out.append({"index": len(prev) + len(out), "t_start": t, "t_end": cut})
+        t = cut
+    if t < duration_sec:
+        out.append({"index": len(prev) + len(out), "t_start": t, "t_end": duration_sec})
+    return out
+
+def extend(prev, available_sec: float, step_sec: float, tolerance_sec: float = 0, scan=None):
+    """
+    `plan` for a file that is still arriving: the windows after `prev` whose
+    cut only depends on the first `available_sec` seconds. They are the
+    cuts `plan` makes for the finished file; its tail is left to `plan`.
+    """
+    tolerance_sec = _tolerance(step_sec, tolerance_sec)
+    t = prev[-1]["t_end"] if prev else 0
+    out = []
+    while t + step_sec + tolerance_sec <= available_sec:
+        cut = _cut(t, step_sec, tolerance_sec, scan)
+        out.append({"index": len(prev) + len(out), "t_start": t, "t_end": cut})
+        t = cut
+    return out
@@ -1,26 +1,344 @@
-import queue, threading, json
-from collections import defaultdict
+import heapq, threading, json, time, uuid
+from app.sse.transport import InProcessTransport, from_config
 
-_queues = defaultdict(list)
-_lock = threading.Lock()
+# Per-video topic: every published event gets a monotonically increasing id
+# and is appended to one shared log. Subscribers only hold a cursor into it,
+# so publishing is an append plus a wakeup whatever the subscriber count, and
+# late or reconnecting subscribers resume from Last-Event-ID out of the same
+# log instead of polling.
+RING_SIZE = 256  # events always retained per topic (up to twice as many are)
+# What happens to a subscriber that falls out of the retained log:
+# "drop_oldest" skips ahead to the oldest retained event, "disconnect" ends
+# the stream with a resync hint (the client reconnects and refetches state)
+OVERFLOW = "drop_oldest"
+HEARTBEAT_SECONDS = 15
+# Topics nobody listens to are kept this long so late joiners still get the log
+TOPIC_TTL_SECONDS = 600
+_SWEEP_SECONDS = 60
+# Topic multiplexing every video's events (ids are never "*"). Events are
+# only copied into it while it has subscribers. Its ids only number what this
+# process has seen, so clients get them as "<epoch>-<n>": a Last-Event-ID
+# from another process or an earlier run can't be resumed and is answered
+# with a resync (refetch state) instead.
+FIREHOSE = "*"
+_EPOCH = uuid.uuid4().hex[:8]
+# Window progress for the same (video, window, phase) is published at most
+# once per interval; the latest value wins
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+class _Topic:
+    __slots__ = ("log", "base", "next_id", "evicted_id", "cond", "cursors", "futures", "touched")
+
+    def __init__(self):
+        self.log = []  # (event_id, message); log[0] is event number `base`
+        self.base = 0
+        self.next_id = 1
+        self.evicted_id = 0  # newest id trimmed from the log
+        self.cond = threading.Condition(threading.Lock())
+        self.cursors = set()
+        self.futures = {}  # event loop -> future resolved on the next append
+        self.touched = time.monotonic()
+
+    @property
+    def end(self):
+        return self.base + len(self.log)
+
+    def append(self, eid, msg):  # under cond
+        self.next_id = max(self.next_id, eid + 1)
+        self.log.append((eid, msg))
+        if len(self.log) >= 2 * RING_SIZE:
+            # Trim in bulk so appends stay amortized O(1)
+            cut = len(self.log) - RING_SIZE
+            self.evicted_id = self.log[cut - 1][0]
+            del self.log[:cut]
+            self.base += cut
+
+class Cursor:
+    """A subscriber's position in a topic's log."""
+
+    def __init__(self, topic, pos):
+        self.topic = topic
+        self.pos = pos
+        self.pending = []
+        self.closed = False
+
+    def _ready(self):
+        return self.pending or self.closed or self.pos < self.topic.end
+
+    def read(self, timeout=None):
+        """
+        Every event past the cursor, waiting up to `timeout` for one ([] on
+        timeout). StopIteration once the overflow policy has closed it.
+        """
+        t = self.topic
+        with t.cond:
+            if not self._ready():
+                t.cond.wait_for(self._ready, timeout)
+            if self.pending:
+                items, self.pending = self.pending, []
+                return items
+            if self.closed:
+                raise StopIteration
+            if self.pos < t.base:
+                if OVERFLOW == "disconnect":
+                    self.closed = True
+                    _stats["disconnected"] += 1
+                    return [(None, json.dumps({"type": "resync", "reason": "overflow"}))]
+                _stats["dropped"] += t.base - self.pos
+                self.pos = t.base
+            items = t.log[self.pos - t.base:]
+            self.pos = t.end
+            return items
+
+    def waiter(self, loop):
+        """For asyncio readers: a future resolved by the next append, or None if `read` wouldn't wait."""
+        t = self.topic
+        with t.cond:
+            if self._ready():
+                return None
+            fut = t.futures.get(loop)
+            if fut is None:
+                fut = t.futures[loop] = loop.create_future()
+            return fut
+
+    def lagging(self):
+        return self.topic.end - self.pos > RING_SIZE // 2
+
+    def close(self):
+        with _lock:
+            self.topic.cursors.discard(self)
+            self.topic.touched = time.monotonic()
+
+_topics = {}
+_lock = threading.Lock()  # guards _topics and topic membership only
+_recorder = None
+_transport = None
+_stats = {"dropped": 0, "disconnected": 0}
+_last_sweep = 0.0
+
+# Coalesced progress: video_id -> {(index, phase): payload} not yet sent, and
+# video_id -> {(index, phase): monotonic time of the last send}. A video's
+# publishes are serialized by its stripe lock so a flushed progress event can
+# never overtake the event that flushed it.
+_pending = {}
+_last_progress = {}
+_stripes = [threading.Lock() for _ in range(32)]
+_due = []  # heap of (deadline, video_id) for the flusher
+_due_cv = threading.Condition()
+_flusher = None
+
+def configure(config):
+    """Set retention and cleanup limits and (re)connect the transport that carries events between processes."""
+    global RING_SIZE, OVERFLOW, HEARTBEAT_SECONDS, PROGRESS_INTERVAL_SECONDS, TOPIC_TTL_SECONDS, _transport
+    RING_SIZE = config.get("SSE_RING_SIZE", RING_SIZE)
+    OVERFLOW = config.get("SSE_OVERFLOW", OVERFLOW)
+    HEARTBEAT_SECONDS = config.get("SSE_HEARTBEAT_SECONDS", HEARTBEAT_SECONDS)
+    PROGRESS_INTERVAL_SECONDS = config.get("SSE_PROGRESS_INTERVAL_SECONDS", PROGRESS_INTERVAL_SECONDS)
+    TOPIC_TTL_SECONDS = config.get("SSE_TOPIC_TTL_SECONDS", TOPIC_TTL_SECONDS)
+    _transport = from_config(config)
+    _transport.start(_deliver)
+
+def set_recorder(fn):
+    """`fn(video_id, payload)` runs before every publish (e.g. the event journal)."""
+    global _recorder
+    _recorder = fn
+
+def _topic(video_id):  # under _lock
+    now = time.monotonic()
+    _sweep(now)
+    t = _topics.get(video_id)
+    if t is None:
+        t = _topics[video_id] = _Topic()
+    t.touched = now
+    return t
+
+def _sweep(now):  # under _lock
+    global _last_sweep
+    if now - _last_sweep < _SWEEP_SECONDS:
+        return
+    _last_sweep = now
+    for video_id in [v for v, t in _topics.items() if not t.cursors and now - t.touched > TOPIC_TTL_SECONDS]:
+        del _topics[video_id]
 
 def publish(video_id: str, payload: dict):
+    """Publish an event in order, after any progress still held back for the video."""
+    with _stripes[hash(video_id) % len(_stripes)]:
+        if _pending.get(video_id):
+            _flush(video_id)
+        _pending.pop(video_id, None)
+        _last_progress.pop(video_id, None)
+        _send(video_id, payload)
+
+def progress(video_id: str, index: int, phase: str, pct, **fields):
+    """
+    Report window progress. Updates closer than PROGRESS_INTERVAL_SECONDS for
+    the same (video, window, phase) are merged and only the latest is sent;
+    any other event for the video flushes it first.
+    """
+    payload = {"type": "window_progress", "index": index, "phase": phase, "pct": pct, **fields}
+    key = (index, phase)
+    with _stripes[hash(video_id) % len(_stripes)]:
+        now = time.monotonic()
+        sent = _last_progress.setdefault(video_id, {})
+        pending = _pending.setdefault(video_id, {})
+        if key not in pending and now - sent.get(key, float("-inf")) >= PROGRESS_INTERVAL_SECONDS:
+            sent[key] = now
+            _send(video_id, payload)
+            return
+        first = not pending
+        pending[key] = payload
+        deadline = sent.get(key, now) + PROGRESS_INTERVAL_SECONDS
+    if first:
+        _schedule(deadline, video_id)
+
+def _flush(video_id):  # under the video's stripe
+    now = time.monotonic()
+    sent = _last_progress.setdefault(video_id, {})
+    for key, payload in _pending.pop(video_id, {}).items():
+        sent[key] = now
+        _send(video_id, payload)
+
+def _schedule(deadline, video_id):
+    global _flusher
+    with _due_cv:
+        heapq.heappush(_due, (deadline, video_id))
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_due, name="sse-progress", daemon=True)
+            _flusher.start()
+        _due_cv.notify()
+
+def _flush_due():
+    while True:
+        with _due_cv:
+            while not _due or _due[0][0] > time.monotonic():
+                _due_cv.wait(_due[0][0] - time.monotonic() if _due else None)
+            _, video_id = heapq.heappop(_due)
+        with _stripes[hash(video_id) % len(_stripes)]:
+            if _pending.get(video_id):
+                _flush(video_id)
+
+def _send(video_id, payload):
+    global _transport
+    # Stamped on a copy: callers may reuse their dict for other topics
+    payload = dict(payload)
+    payload.setdefault("ts", round(time.time(), 3))
+    if _recorder:
+        _recorder(video_id, payload)
     msg = json.dumps(payload)
+    if _transport is None:
+        _transport = InProcessTransport()
+        _transport.start(_deliver)
+    t = _topics.get(video_id)
+    last_id = t.next_id - 1 if t else 0
+    # Journaled events already carry a monotonic seq; it becomes the id
+    _transport.send(video_id, msg, last_id, payload.get("seq"))
+
+def _resolve(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+def _deliver(video_id, eid, msg):
+    """Called by the transport, in order, for every event of every process."""
     with _lock:
-        for q in list(_queues[video_id]):
-            try: q.put_nowait(msg)
-            except: pass
+        t = _topic(video_id)
+        fire = _topics.get(FIREHOSE)
+    eid = _append(t, eid, msg)
+    if fire is not None and fire.cursors:
+        _append(fire, None, f'{{"video_id": {json.dumps(video_id)}, "event_id": {eid}, "event": {msg}}}')
 
-def subscribe(video_id: str):
-    q = queue.Queue(maxsize=100)
+def _append(t, eid, msg):
+    with t.cond:
+        eid = t.next_id if eid is None else eid
+        t.append(eid, msg)
+        t.cond.notify_all()
+        futures, t.futures = t.futures, {}
+    # One wakeup per event loop, however many coroutines wait in it
+    for loop, fut in futures.items():
+        loop.call_soon_threadsafe(_resolve, fut)
+    return eid
+
+def firehose_filter(videos=None, types=None):
+    """Predicate on firehose messages for the given video ids / event types (None: everything)."""
+    if not videos and not types:
+        return None
+    videos, types = set(videos or ()), set(types or ())
+    def match(msg):
+        m = json.loads(msg)
+        return (not videos or m["video_id"] in videos) and (not types or m["event"].get("type") in types)
+    return match
+
+def firehose_id(eid):
+    """The id a client sees for firehose event `eid` (None stays None)."""
+    return None if eid is None else f"{_EPOCH}-{eid}"
+
+def frame(eid, msg):
+    """One SSE frame; events without an id (resync) don't move the client's cursor."""
+    return (f"id: {eid}\n" if eid is not None else "") + f"data: {msg}\n\n"
+
+def attach(video_id: str, last_event_id=None, replay=True):
+    """
+    A Cursor over `video_id` positioned after `last_event_id` (at the oldest
+    retained event if None), or at the live end without `replay`. For the
+    firehose `last_event_id` is the string from firehose_id(). Close it
+    when done; the topic is dropped TOPIC_TTL_SECONDS after its last
+    subscriber leaves.
+    """
+    stale = False
+    if video_id == FIREHOSE and last_event_id is not None:
+        epoch, _, n = str(last_event_id).partition("-")
+        if epoch == _EPOCH and n.isdigit():
+            last_event_id = int(n)
+        else:  # numbered by another process
+            last_event_id, replay, stale = None, False, True
     with _lock:
-        _queues[video_id].append(q)
+        t = _topic(video_id)
+        with t.cond:
+            if not replay:
+                cur = Cursor(t, t.end)
+            elif last_event_id is None:
+                cur = Cursor(t, max(t.base, t.end - RING_SIZE))
+            elif last_event_id < t.evicted_id or last_event_id >= t.next_id:
+                # Trimmed from the log, or ahead of a topic that was swept and
+                # started over: either way the client must refetch state
+                cur = Cursor(t, t.base if last_event_id < t.evicted_id else t.end)
+                cur.pending.append((None, json.dumps({"type": "resync"})))
+            else:
+                i = len(t.log)
+                while i > 0 and t.log[i - 1][0] > last_event_id:
+                    i -= 1
+                cur = Cursor(t, t.base + i)
+            if stale:
+                cur.pending.append((None, json.dumps({"type": "resync", "reason": "reconnect"})))
+        t.cursors.add(cur)
+    return cur
+
+def subscribe(video_id: str, last_event_id=None, replay=True, heartbeat=None):
+    """
+    Yield (event_id, message) for `video_id`. With `replay`, first re-deliver
+    retained events newer than `last_event_id` (all retained ones if None);
+    if some were already trimmed a {"type": "resync"} event with id None
+    comes first, telling the client to refetch state. With `heartbeat`, None
+    is yielded after that many idle seconds so the caller can write a
+    keep-alive (and find out the client is gone). Ends after a resync when
+    the overflow policy disconnects a lagging subscriber.
+    """
+    cur = attach(video_id, last_event_id, replay)
     def gen():
         try:
             while True:
-                yield q.get()
+                try:
+                    items = cur.read(heartbeat)
+                except StopIteration:
+                    return
+                if not items:
+                    yield None
+                yield from items
         finally:
-            with _lock:
-                if q in _queues[video_id]:
-                    _queues[video_id].remove(q)
+            cur.close()
     return gen()
+
+def stats():
+    with _lock:
+        cursors = [c for t in _topics.values() for c in t.cursors]
+        return {"topics": len(_topics), "subscribers": len(cursors),
+                "lagging": sum(1 for c in cursors if c.lagging()), **_stats}
@@ -0,0 +1,158 @@
+"""
+Live operator view folded from the broker firehose: active jobs, their
+current stage and window progress, and per-stage throughput.
+
+Started on the first snapshot() call, so processes nobody asks don't keep a
+firehose subscriber (and pay for copying events into it). Jobs already
+running at that point are seeded from storage's index of active videos;
+their stage timings start with the next window. Throughput is averaged over
+the last THROUGHPUT_WINDOW_SECONDS, or over as much of that as the view has
+been following.
+"""
+
+import json, threading, time
+from collections import deque
+from app.sse import broker
+
+# Window phase a stage ends with -> the stage name
+_STAGE_END = {"window_transcribed": "transcribe", "window_frames": "frames", "window_done": "summarize"}
+THROUGHPUT_WINDOW_SECONDS = 600
+
+_lock = threading.Lock()
+_started = False
+_jobs = {}  # video_id -> live job summary
+_phase_ts = {}  # (video_id, index) -> ts of the window's last phase event
+_finished = deque()  # (ts, stage, seconds) of recently completed stages
+_since = None  # time.time() the firehose has been followed from
+
+def _job(video_id):  # under _lock
+    j = _jobs.get(video_id)
+    if j is None:
+        j = _jobs[video_id] = {"video_id": video_id, "status": "processing", "stage": None,
+                               "windows_done": 0, "windows_failed": 0, "running": {}, "updated": None}
+    return j
+
+def _apply(video_id, e):  # under _lock
+    kind, ts = e.get("type"), e.get("ts") or time.time()
+    if kind in ("video_done", "video_cancelled", "video_stalled"):
+        _jobs.pop(video_id, None)
+        for key in [k for k in _phase_ts if k[0] == video_id]:
+            del _phase_ts[key]
+        return
+    j = _job(video_id)
+    j["updated"] = ts
+    if kind == "video_started":
+        j["status"] = e.get("status", "queued")
+        return
+    if kind == "video_ingest":
+        j["status"], j["ingest"] = "ingesting", {k: e[k] for k in ("bytes", "size", "available_sec")}
+        return
+    if kind == "video_ingested":
+        j["status"] = "processing"
+        j.pop("ingest", None)
+        return
+    idx = e.get("index")
+    if idx is None:
+        return
+    if j["status"] != "ingesting":
+        j["status"] = "processing"
+    key = (video_id, idx)
+    if kind == "window_started":
+        _phase_ts[key] = ts
+        j["running"][idx] = {"phase": "transcribe", "pct": 0}
+        j["stage"] = "transcribe"
+    elif kind == "window_progress":
+        j["running"][idx] = {"phase": e["phase"], "pct": e["pct"]}
+        j["stage"] = e["phase"]
+    elif kind in _STAGE_END:
+        stage = _STAGE_END[kind]
+        if key in _phase_ts:
+            _finished.append((ts, stage, ts - _phase_ts[key]))
+        _phase_ts[key] = ts
+        nxt = {"window_transcribed": "frames", "window_frames": "summarize"}.get(kind)
+        if nxt:
+            j["running"][idx] = {"phase": nxt, "pct": 0}
+            j["stage"] = nxt
+        else:
+            j["running"].pop(idx, None)
+            _phase_ts.pop(key, None)
+            j["windows_done"] += 1
+    elif kind == "window_failed":
+        j["running"].pop(idx, None)
+        _phase_ts.pop(key, None)
+        j["windows_failed"] += 1
+
+def _follow(sub):
+    while True:
+        for item in sub:
+            if item is None or item[0] is None:
+                continue  # heartbeat / resync: the next events carry on
+            m = json.loads(item[1])
+            with _lock:
+                _apply(m["video_id"], m["event"])
+        # Fell behind with SSE_OVERFLOW=disconnect: events were missed, so
+        # start over from storage rather than serve a frozen view
+        sub = _subscribe()
+        with _lock:
+            _jobs.clear()
+            _phase_ts.clear()
+            _finished.clear()  # stages that ended in the gap are gone too
+        _seed()
+
+def _subscribe():
+    return broker.subscribe(broker.FIREHOSE, replay=False, heartbeat=broker.HEARTBEAT_SECONDS)
+
+def _seed():
+    global _since
+    from app.services import storage
+    with _lock:
+        _since = time.time()
+    for vid in storage.iter_active_video_ids():
+        v = storage.read_video_state(vid)
+        if not v or v.get("status") not in storage.ACTIVE_STATUSES:
+            continue
+        wins = v.get("windows", [])
+        with _lock:
+            j = _job(vid)
+            j["status"] = v["status"]
+            j["windows_done"] = sum(1 for w in wins if w.get("status") == "done")
+            j["windows_failed"] = sum(1 for w in wins if w.get("status") == "failed")
+
+def start():
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    # Subscribe before seeding so nothing falls between the two
+    sub = _subscribe()
+    _seed()
+    threading.Thread(target=_follow, args=(sub,), name="sse-dashboard", daemon=True).start()
+
+def snapshot():
+    """Active jobs (with window totals from storage) and per-stage throughput."""
+    from app.services import storage
+    start()
+    now = time.time()
+    with _lock:
+        while _finished and _finished[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+            _finished.popleft()
+        jobs = [dict(j, running=[{"index": i, **r} for i, r in sorted(j["running"].items())])
+                for j in _jobs.values()]
+        finished = list(_finished)
+        observed = min(THROUGHPUT_WINDOW_SECONDS, max(now - _since, 1.0))
+    for j in jobs:
+        v = storage.read_video_state(j["video_id"]) or {}
+        j["windows_total"] = len(v.get("windows", []))
+    stages = {}
+    for _, stage, secs in finished:
+        s = stages.setdefault(stage, {"windows": 0, "seconds": 0.0})
+        s["windows"] += 1
+        s["seconds"] += secs
+    throughput = {
+        stage: {"windows_per_min": round(s["windows"] * 60 / observed, 2),
+                "mean_seconds": round(s["seconds"] / s["windows"], 2)}
+        for stage, s in stages.items()
+    }
+    return {"ts": round(now, 3), "jobs": sorted(jobs, key=lambda j: j["video_id"]),
+            "throughput": throughput, "window_seconds": round(observed, 1), "broker": broker.stats()}
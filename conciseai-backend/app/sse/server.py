@@ -0,0 +1,145 @@
+"""
+Asyncio SSE endpoint: GET /videos/<id>/events and the /events firehose on
+their own port. Every idle subscriber is a coroutine on one event-loop
+thread instead of a WSGI thread blocked on a queue, so thousands of open
+tabs cost sockets, not threads.
+
+    SSE_PORT=5001                        # served from a thread of the API process
+    python -m app.sse.server --port 5001 # standalone; needs BROKER_TRANSPORT=unix
+
+Same semantics as the Flask route (Last-Event-ID replay, journal backfill),
+plus a ": ping" comment every SSE_HEARTBEAT_SECONDS so proxies keep the
+connection open and dead clients are noticed on the next write.
+"""
+
+import argparse, asyncio, json, logging, re, threading
+from urllib.parse import parse_qs, unquote, urlsplit
+from app.sse import broker
+
+log = logging.getLogger(__name__)
+
+_PATH = re.compile(r"^(?:/videos/([^/]+))?/events$")
+
+_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"X-Accel-Buffering: no\r\n"
+    b"Connection: keep-alive\r\n\r\n"
+)
+
+async def _request(reader):
+    """(path, query, headers) of the request line and headers, or None."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3 or parts[0] != "GET":
+        return None
+    headers = {}
+    for line in lines[1:]:
+        k, _, v = line.partition(":")
+        if v:
+            headers[k.strip().lower()] = v.strip()
+    url = urlsplit(parts[1])
+    return url.path, parse_qs(url.query), headers
+
+async def _handle(reader, writer):
+    loop = asyncio.get_running_loop()
+    req = await _request(reader)
+    m = req and _PATH.match(req[0])
+    if not m:
+        writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        writer.close()
+        return
+    _, query, headers = req
+    last = headers.get("last-event-id") or query.get("last_event_id", [""])[0]
+    ids = None  # how event ids are shown to the client
+    if m.group(1):
+        last = int(last) if last.isdigit() else None
+        video_id, match = unquote(m.group(1)), None
+        from app.services import storage
+        journaled = storage.backend() == "journal"
+        replay = not journaled
+    else:
+        # Firehose (/events?video=&type=): live only unless resuming
+        csv = lambda k: [x for x in query.get(k, [""])[0].split(",") if x] or None
+        video_id, match = broker.FIREHOSE, broker.firehose_filter(csv("video"), csv("type"))
+        last, ids = last or None, broker.firehose_id
+        journaled, replay = False, last is not None
+    # With the journal the full history is replayed from disk, so skip the log
+    cur = broker.attach(video_id, last_event_id=last, replay=replay)
+    try:
+        writer.write(_HEADERS)
+        seen = -1
+        if journaled:
+            from app.services import journal
+            backlog = await loop.run_in_executor(None, lambda: list(journal.events(video_id, last)))
+            seen = last if last is not None else -1
+            for seq, payload in backlog:
+                seen = seq
+                writer.write(broker.frame(seq, json.dumps(payload)).encode("utf-8"))
+        await writer.drain()
+        while True:
+            fut = cur.waiter(loop)
+            if fut is not None:
+                try:
+                    # Shielded: the future is shared by every reader of this topic
+                    await asyncio.wait_for(asyncio.shield(fut), broker.HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                    await writer.drain()
+                    continue
+            try:
+                items = cur.read(0)
+            except StopIteration:
+                break  # disconnected by the overflow policy
+            for eid, msg in items:
+                if match and eid is not None and not match(msg):
+                    continue
+                if journaled and eid is not None:
+                    if eid <= seen:
+                        continue
+                    seen = eid
+                writer.write(broker.frame(ids(eid) if ids else eid, msg).encode("utf-8"))
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        cur.close()
+        writer.close()
+
+async def serve(host, port):
+    # reuse_port lets every gunicorn worker bind the same SSE port
+    server = await asyncio.start_server(_handle, host, port, reuse_port=True)
+    log.info("sse server on %s:%d", host, port)
+    async with server:
+        await server.serve_forever()
+
+def start(config):
+    """Serve SSE_PORT from a daemon thread of this process."""
+    threading.Thread(target=lambda: asyncio.run(serve(config["SSE_HOST"], config["SSE_PORT"])),
+                     name="sse-server", daemon=True).start()
+
+def main(argv=None):
+    from app.config import load
+    from app.services import storage
+    config = load()
+    p = argparse.ArgumentParser(prog="python -m app.sse.server")
+    p.add_argument("--host", default=config["SSE_HOST"])
+    p.add_argument("--port", type=int, default=config["SSE_PORT"] or 5001)
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    storage.configure(config)
+    broker.configure(config)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
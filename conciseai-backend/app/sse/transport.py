@@ -0,0 +1,151 @@
+"""
+Broker transports: how a published event reaches every process's broker.
+
+  InProcessTransport  events stay in this process (single gunicorn worker,
+                      pipeline in executor threads)
+  UnixSocketTransport every process connects to one hub over a Unix-domain
+                      socket; the hub assigns event ids and fans each event
+                      out to all processes (API workers, pipeline workers)
+
+The hub is elected with an flock on <socket>.lock: whichever process holds
+it binds the socket and serves it from a thread; if that process dies the
+lock is released and the next process to reconnect takes over. Publishing
+is one sendall() of a JSON line, so it stays well under a millisecond.
+"""
+
+import json, logging, os, socket, threading, time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+class InProcessTransport:
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def send(self, topic, msg, last_id=0, seq=None):
+        self._deliver(topic, seq, msg)
+
+class _Hub:
+    """Accepts process connections and rebroadcasts every frame with an id."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.conns = set()
+        self.next_ids = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept, name="broker-hub", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            conn, _ = self.sock.accept()
+            conn.settimeout(1.0)  # a stuck process gets dropped, not waited on
+            with self.lock:
+                self.conns.add(conn)
+            threading.Thread(target=self._read, args=(conn,), daemon=True).start()
+
+    def _read(self, conn):
+        try:
+            f = conn.makefile("rb")
+            for line in f:
+                frame = json.loads(line)
+                topic = frame["t"]
+                with self.lock:
+                    # Publishers report the last id they saw, so a new hub
+                    # (after failover) never hands out an id twice
+                    nid = max(self.next_ids.get(topic, 1), frame.get("l", 0) + 1)
+                    eid = frame["s"] if frame.get("s") is not None else nid
+                    self.next_ids[topic] = max(nid, eid + 1)
+                    out = (json.dumps({"t": topic, "i": eid, "m": frame["m"]}) + "\n").encode("utf-8")
+                    for c in list(self.conns):
+                        try:
+                            c.sendall(out)
+                        except OSError:
+                            self.conns.discard(c)
+                            c.close()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                self.conns.discard(conn)
+            conn.close()
+
+class UnixSocketTransport:
+    def __init__(self, path):
+        self.path = path
+        self._sock = None
+        self._wlock = threading.Lock()
+        self._hub = None
+        self._lockfd = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self._connect()
+        threading.Thread(target=self._read, name="broker-client", daemon=True).start()
+
+    def _elect(self):
+        # Become the hub if nobody holds the lock
+        if fcntl is None or self._hub is not None:
+            return
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return
+        try:
+            os.unlink(self.path)  # stale socket of a dead hub
+        except FileNotFoundError:
+            pass
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(self.path)
+        srv.listen(128)
+        self._lockfd = fd
+        self._hub = _Hub(srv)
+        log.info("broker hub listening on %s (pid %d)", self.path, os.getpid())
+
+    def _connect(self):
+        delay = 0.01
+        while True:
+            self._elect()
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.path)
+                self._sock = s
+                return
+            except OSError:
+                s.close()
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+
+    def _read(self):
+        while True:
+            try:
+                for line in self._sock.makefile("rb"):
+                    frame = json.loads(line)
+                    self._deliver(frame["t"], frame["i"], frame["m"])
+            except (OSError, ValueError):
+                pass
+            log.warning("broker hub connection lost, reconnecting")
+            with self._wlock:
+                self._sock.close()
+                self._connect()
+
+    def send(self, topic, msg, last_id=0, seq=None):
+        data = (json.dumps({"t": topic, "m": msg, "l": last_id, "s": seq}) + "\n").encode("utf-8")
+        with self._wlock:
+            try:
+                self._sock.sendall(data)
+                return
+            except OSError:
+                pass
+        # Hub unreachable: at least reach this process's subscribers
+        self._deliver(topic, seq, msg)
+
+def from_config(config):
+    if config.get("BROKER_TRANSPORT", "inprocess") == "unix":
+        return UnixSocketTransport(config["BROKER_SOCKET"])
+    return InProcessTransport()
@@ -0,0 +1,83 @@
+"""
+Broker fan-out benchmark (in-process transport):
+
+    python -m app.tools.bench_broker [--subscribers 1000] [--events 2000] [--threads]
+
+Subscribers are coroutines on one event loop, like the asyncio SSE server,
+or with --threads one blocking `subscribe()` generator per thread, like the
+Flask route. Reports the publisher-side cost per event (should not grow
+with the subscriber count) and how long until every subscriber has read
+every event.
+"""
+
+import argparse, asyncio, threading, time
+from app.sse import broker
+
+TOPIC = "bench"
+
+def _async_subscribers(n, events, done):
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    async def reader():
+        cur = broker.attach(TOPIC, replay=False)
+        got = 0
+        while got < events:
+            fut = cur.waiter(loop)
+            if fut is not None:
+                await asyncio.shield(fut)
+            got += len(cur.read(0))
+        cur.close()
+    async def run():
+        tasks = [asyncio.ensure_future(reader()) for _ in range(n)]
+        await asyncio.sleep(0.1)  # let every reader attach
+        ready.set()
+        await asyncio.gather(*tasks)
+        done.set()
+    threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True).start()
+    ready.wait()
+
+def _thread_subscribers(n, events, done):
+    left = [n]
+    lock = threading.Lock()
+    def reader(sub):
+        for i, _ in enumerate(sub, 1):
+            if i == events:
+                break
+        sub.close()
+        with lock:
+            left[0] -= 1
+            if not left[0]:
+                done.set()
+    for _ in range(n):
+        # Attach here so no event is published before every reader exists
+        threading.Thread(target=reader, args=(broker.subscribe(TOPIC, replay=False),), daemon=True).start()
+
+def bench(n, events, threads):
+    broker.configure({"SSE_RING_SIZE": max(events, 256)})
+    done = threading.Event()
+    if n:
+        (_thread_subscribers if threads else _async_subscribers)(n, events, done)
+    payload = {"type": "window_progress", "video_id": TOPIC, "index": 0, "phase": "transcribe"}
+    t0 = time.perf_counter()
+    for _ in range(events):
+        broker.publish(TOPIC, payload)
+    t1 = time.perf_counter()
+    if n:
+        done.wait()
+    t2 = time.perf_counter()
+    return (t1 - t0) / events * 1e6, t2 - t0
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m app.tools.bench_broker")
+    p.add_argument("--subscribers", type=int, default=1000)
+    p.add_argument("--events", type=int, default=2000)
+    p.add_argument("--threads", action="store_true", help="one blocking subscriber per thread")
+    args = p.parse_args(argv)
+
+    for n in (0, args.subscribers):
+        per_event, total = bench(n, args.events, args.threads)
+        print(f"{n:>6} subscribers: publish {per_event:7.1f} us/event, "
+              f"all delivered in {total:.3f}s ({n * args.events / total:,.0f} deliveries/s)")
+
+if __name__ == "__main__":
+    main()
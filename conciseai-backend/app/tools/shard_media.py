@@ -0,0 +1,73 @@
+"""
+Online migration of a flat MEDIA_ROOT/videos/<id> layout to the sharded
+videos/ab/cd/<id> layout:
+
+    python -m app.tools.shard_media [--dry-run] [--include-active]
+
+Each video moves with a single rename, so readers see it at either the old
+or the new path (lookups check both); the old path then becomes a symlink
+to the new one, so a writer still holding it can't recreate the directory.
+Videos whose job is queued, running or stalled, and upload sessions that
+have no video yet, are skipped unless --include-active; run again later to
+pick them up.
+"""
+
+import argparse, os, shutil
+from app.config import load
+from app.services import storage
+
+def _busy(vid):
+    """Why the video must stay put for now, or None."""
+    v = storage.read_video_state(vid)
+    if v is None:
+        if os.path.exists(os.path.join(storage.legacy_video_dir(vid), "upload.json")):
+            return "upload in progress"
+        return None
+    if v.get("status") in storage.ACTIVE_STATUSES + ("stalled",):
+        return v["status"]
+    return None
+
+def _move(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    os.rename(src, dst)
+    link = os.path.relpath(dst, os.path.dirname(src))
+    while True:
+        try:
+            os.symlink(link, src)
+            return
+        except FileExistsError:
+            # A writer recreated the old directory between the rename and the
+            # link: fold what it wrote into the new one
+            for root, _, files in os.walk(src):
+                os.makedirs(os.path.join(dst, os.path.relpath(root, src)), exist_ok=True)
+                for name in files:
+                    os.replace(os.path.join(root, name), os.path.join(dst, os.path.relpath(root, src), name))
+            shutil.rmtree(src, ignore_errors=True)
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m app.tools.shard_media")
+    p.add_argument("--dry-run", action="store_true")
+    p.add_argument("--include-active", action="store_true")
+    args = p.parse_args(argv)
+
+    storage.configure(load())
+    moved = skipped = 0
+    for vid in storage.iter_legacy_video_ids():
+        busy = _busy(vid)
+        if busy and not args.include_active:
+            print(f"skip   {vid} ({busy})")
+            skipped += 1
+            continue
+        src, dst = storage.legacy_video_dir(vid), storage.sharded_video_dir(vid)
+        if os.path.exists(dst):
+            print(f"skip   {vid} (already at {dst})")
+            skipped += 1
+            continue
+        print(f"move   {vid} -> {os.path.relpath(dst, storage.media_root())}")
+        if not args.dry_run:
+            _move(src, dst)
+        moved += 1
+    print(f"{moved} moved, {skipped} skipped")
+
+if __name__ == "__main__":
+    main()
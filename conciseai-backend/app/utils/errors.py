@@ -0,0 +1,12 @@
+class JobCancelled(Exception):
+    """Raised inside a pipeline job once its cancellation token has fired."""
+
+class UploadConflict(Exception):
+    """An upload chunk or finalize request that doesn't fit the session; `offset` is where it stands."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+class UnsupportedMedia(Exception):
+    """Uploaded bytes that aren't a video this service can process."""
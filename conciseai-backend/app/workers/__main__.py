@@ -0,0 +1,76 @@
+"""
+Standalone pipeline worker:
+
+    python -m app.workers [--concurrency N]
+
+Configured from `Config` (env overrides: MEDIA_ROOT, WORKER_CONCURRENCY) and
+never touches Flask. Start as many as you like, on this host or on others
+sharing MEDIA_ROOT; they drain MEDIA_ROOT/queue cooperatively. The API only
+enqueues when JOB_BACKEND=queue.
+"""
+
+import argparse, logging, signal, threading, time
+from app.config import load
+from app.services import storage, procs, state, retention
+from app.workers import queue
+from app.sse import broker
+from app.workers.scheduler import WindowScheduler
+from app.pipelines import stream_windows
+
+log = logging.getLogger("app.workers")
+
+def _want_more(sched, max_active):
+    # Take a new video only when its first window could start soon: a free
+    # thread and no other video's first window still waiting. Otherwise leave
+    # it in the queue for a less busy worker.
+    return sched.idle() > 0 and not sched.has_urgent() and sched.active() < max_active
+
+def main(argv=None):
+    config = load()
+    p = argparse.ArgumentParser(prog="python -m app.workers")
+    p.add_argument("--concurrency", type=int, default=config["WORKER_CONCURRENCY"])
+    p.add_argument("--poll", type=float, default=config["WORKER_POLL_SECONDS"])
+    p.add_argument("--max-active", type=int, default=config["WORKER_MAX_ACTIVE_VIDEOS"])
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    storage.configure(config)
+    procs.configure(config)
+    state.configure(config)
+    stream_windows.configure(config)
+    broker.configure(config)
+    broker.set_recorder(storage.record_event)
+    retention.start(config)
+    queue.recover()
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    sched = WindowScheduler(max_workers=args.concurrency)
+    jobs = {}
+
+    def done(video_id):
+        job = jobs.pop(video_id)
+        queue.complete(job)
+        log.info("job %s finished", video_id)
+
+    log.info("worker up: media_root=%s concurrency=%d", storage.media_root(), args.concurrency)
+    while not stop.is_set():
+        if not _want_more(sched, args.max_active):
+            stop.wait(0.1)
+            continue
+        job = queue.claim()
+        if job is None:
+            stop.wait(args.poll)
+            continue
+        log.info("job %s claimed by %s", job["video_id"], job["worker"])
+        jobs[job["video_id"]] = job
+        sched.submit(job["video_id"], job["master_path"], on_done=done, ingest=job.get("ingest", False))
+
+    log.info("shutting down, waiting for %d active jobs", sched.active())
+    while sched.active():
+        time.sleep(0.5)
+
+if __name__ == "__main__":
+    main()
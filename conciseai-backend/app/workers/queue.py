@@ -0,0 +1,85 @@
+"""
+Filesystem job queue under MEDIA_ROOT/queue, shared by every worker that
+mounts the same MEDIA_ROOT (one host or several).
+
+  pending/<ts>_<video_id>.json   waiting to be picked up
+  running/<ts>_<video_id>.json   claimed by a worker (os.rename is the lock)
+
+Jobs store the master file name relative to the video directory so hosts can
+mount MEDIA_ROOT at different paths.
+"""
+
+import os, time, socket
+from app.services import storage
+
+def _dir(name):
+    d = os.path.join(storage.media_root(), "queue", name)
+    os.makedirs(d, exist_ok=True)
+    return d
+
+def enqueue(video_id: str, master_path: str, ingest: bool = False):
+    name = f"{time.time_ns():020d}_{video_id}.json"
+    storage._atomic_write_json(os.path.join(_dir("pending"), name), {
+        "video_id": video_id,
+        "master": os.path.basename(master_path),
+        "ingest": ingest,
+        "enqueued_at": time.time(),
+    })
+    return name
+
+def claim():
+    """Atomically move the oldest pending job to running/. Returns the job or None."""
+    pending, running = _dir("pending"), _dir("running")
+    for name in sorted(os.listdir(pending)):
+        if not name.endswith(".json"):
+            continue  # tempfiles of an in-flight enqueue
+        try:
+            os.rename(os.path.join(pending, name), os.path.join(running, name))
+        except FileNotFoundError:
+            continue  # another worker won the race
+        job = dict(storage.read_json(os.path.join(running, name)) or {})
+        job["worker"] = f"{socket.gethostname()}:{os.getpid()}"
+        storage._atomic_write_json(os.path.join(running, name), job)
+        job["name"] = name
+        job["master_path"] = os.path.join(storage.video_dir(job["video_id"]), job["master"])
+        return job
+    return None
+
+def recover():
+    """Put back jobs claimed by workers on this host that are no longer alive."""
+    host = socket.gethostname()
+    running, pending = _dir("running"), _dir("pending")
+    for name in os.listdir(running):
+        job = storage.read_json(os.path.join(running, name)) or {}
+        whost, _, pid = job.get("worker", "").rpartition(":")
+        if whost != host or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue
+        try:
+            os.rename(os.path.join(running, name), os.path.join(pending, name))
+        except FileNotFoundError:
+            pass
+
+def drop(video_id: str):
+    """Remove a not-yet-claimed job. Returns True if one was pending."""
+    pending = _dir("pending")
+    for name in os.listdir(pending):
+        if name.endswith(f"_{video_id}.json"):
+            try:
+                os.remove(os.path.join(pending, name))
+                return True
+            except FileNotFoundError:
+                pass
+    return False
+
+def complete(job):
+    try:
+        os.remove(os.path.join(_dir("running"), job["name"]))
+    except FileNotFoundError:
+        pass
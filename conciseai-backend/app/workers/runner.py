@@ -1,7 +1,23 @@
-from concurrent.futures import ThreadPoolExecutor
-from app.pipelines.stream_windows import run
+from app.workers import queue
+from app.workers.scheduler import WindowScheduler
 
-_executor = ThreadPoolExecutor(max_workers=2)
+_scheduler = None
+_backend = "thread"
 
-def submit_stream_job(video_id: str, master_path: str):
-    _executor.submit(run, video_id, master_path)
+def configure(config):
+    global _scheduler, _backend
+    _backend = config.get("JOB_BACKEND", "thread")
+    if _backend == "thread" and _scheduler is None:
+        _scheduler = WindowScheduler(max_workers=config.get("WORKER_CONCURRENCY", 2))
+
+def submit_stream_job(video_id: str, master_path: str, ingest: bool = False):
+    """`ingest`: the master is still uploading (see stream_windows.ingest_tick)."""
+    if _backend == "queue":
+        queue.enqueue(video_id, master_path, ingest)
+        return
+    if _scheduler is None:
+        configure({"JOB_BACKEND": "thread"})
+    _scheduler.submit(video_id, master_path, ingest=ingest)
+
+def stats():
+    return _scheduler.stats() if _scheduler else {}
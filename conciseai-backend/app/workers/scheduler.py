@@ -0,0 +1,236 @@
+"""
+Window-granularity job scheduler.
+
+Instead of running a whole video per thread (FIFO), every video is split
+into tasks that share one thread pool, ordered by priority:
+
+  class 0  the start task and the FIRST window of every video, by arrival
+  class 1  all remaining windows, round-robin across active videos
+
+Round-robin uses a virtual clock: a video's k-th remaining window gets
+vtime = clock_at_start + k, where the clock advances as class-1 tasks are
+dispatched. A video arriving late therefore interleaves with older videos
+instead of queueing behind their whole backlog.
+
+A video's plan ends with one more class-1 task that builds its keyframe
+index (a pass over the whole file), so that never delays a first window.
+
+A video submitted with ingest=True is still uploading: after its start task
+an ingest task is re-queued every INGEST_POLL_SECONDS to pick up windows that
+have arrived, until the upload completes. After INGEST_MAX_ERRORS failed
+ingest tasks in a row (or one finding the upload isn't a video) it stops,
+and the video fails once its queued windows are done.
+"""
+
+import heapq, itertools, logging, statistics, threading, time
+from collections import deque
+from app.pipelines import stream_windows
+from app.services import procs, state
+from app.utils.errors import JobCancelled, UnsupportedMedia
+
+log = logging.getLogger(__name__)
+
+_INGEST = "ingest"  # task marker: look for newly arrived windows
+_INDEX = "index"  # task marker: build the keyframe index
+
+class _Video:
+    def __init__(self, video_id, master_path, on_done, ingest=False):
+        self.video_id = video_id
+        self.master_path = master_path
+        self.on_done = on_done
+        self.token = procs.register(video_id)
+        self.remaining = None  # windows left; None until the start task ran
+        self.ingesting = ingest
+        self.ingest_errors = 0  # failed ingest tasks in a row
+        self.pushed = 0  # windows queued so far
+        self.cancelled = False
+        self.error = None  # set when the job can't go on; the video settles "failed"
+        self.submitted_at = time.monotonic()
+        self.first_done_at = None
+
+class WindowScheduler:
+    def __init__(self, max_workers=2):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._vclock = 0
+        self._videos = {}
+        self._ttfw = deque(maxlen=200)  # seconds from submit to first window_done
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"window-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        self._idle = max_workers
+        for t in self._threads:
+            t.start()
+
+    # ---------------- public API ----------------
+
+    def submit(self, video_id, master_path, on_done=None, ingest=False):
+        with self._cond:
+            if video_id in self._videos:
+                return
+            self._videos[video_id] = _Video(video_id, master_path, on_done, ingest)
+            self._push((0, 0), video_id, None)
+
+    def active(self):
+        with self._cond:
+            return len(self._videos)
+
+    def has_urgent(self):
+        """True while some video's start/first window is still waiting."""
+        with self._cond:
+            return any(key[0] == 0 for key, *_ in self._heap)
+
+    def idle(self):
+        with self._cond:
+            return self._idle
+
+    def stats(self):
+        with self._cond:
+            ttfw = list(self._ttfw)
+            return {
+                "active_videos": len(self._videos),
+                "queued_tasks": len(self._heap),
+                "idle_workers": self._idle,
+                "ttfw_median_s": round(statistics.median(ttfw), 3) if ttfw else None,
+                "ttfw_samples": len(ttfw),
+            }
+
+    # ---------------- internals ----------------
+
+    def _push(self, prio, video_id, win):  # under lock
+        heapq.heappush(self._heap, (prio, next(self._seq), video_id, win))
+        self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                prio, _, video_id, win = heapq.heappop(self._heap)
+                if prio[0] == 1:
+                    self._vclock = max(self._vclock, prio[1])
+                job = self._videos[video_id]
+                self._idle -= 1
+            try:
+                self._run_task(job, win)
+            except Exception as e:
+                if win is _INGEST:
+                    self._ingest_failed(job, e)
+                else:  # the start task: no plan, nothing else will finish it
+                    log.exception("task for %s crashed", video_id)
+                    job.error = str(e)
+                    self._finish(job)
+            finally:
+                with self._cond:
+                    self._idle += 1
+
+    def _run_task(self, job, win):
+        procs.bind(job.token)
+        try:
+            if job.cancelled or job.token.cancelled:
+                raise JobCancelled(job.video_id)
+            if win is None:
+                wins = stream_windows.start(job.video_id, job.master_path)
+                if wins is None:  # video vanished
+                    self._finish(job)
+                elif self._planned(job, wins if job.ingesting else wins + [_INDEX], job.ingesting):
+                    self._ingest_later(job, 0)
+                return
+            if win is _INGEST:
+                wins, done = stream_windows.ingest_tick(job.video_id, job.master_path)
+                job.ingest_errors = 0
+                if self._planned(job, wins, not done):
+                    self._ingest_later(job, stream_windows.INGEST_POLL_SECONDS)
+                return
+            if win is _INDEX:
+                stream_windows.index_keyframes(job.video_id, job.master_path)
+            else:
+                stream_windows.process_window(job.video_id, job.master_path, win)
+                self._first_done(job)
+        except JobCancelled:
+            job.cancelled = True
+            if win is None or win is _INGEST:
+                self._planned(job, [], False)
+                return
+        except Exception:
+            if win is None or win is _INGEST:
+                raise  # handled in _loop
+            # e.g. the state write failed: still count the window as attempted,
+            # or the video never finishes and the worker never drains
+            log.exception("%s of %s crashed", "keyframe index" if win is _INDEX else f"window {win['index']}", job.video_id)
+        finally:
+            procs.bind(None)
+        self._window_finished(job)
+
+    def _planned(self, job, wins, ingesting=False):
+        """
+        Queue newly planned windows (the whole plan, or an ingest batch).
+        Returns True while the video is still ingesting; finishes it if
+        nothing is left.
+        """
+        with self._cond:
+            job.remaining = (job.remaining or 0) + len(wins)
+            job.ingesting = ingesting
+            for k, win in enumerate(wins):
+                prio = (0, 0) if job.pushed == 0 else (1, self._vclock + k)
+                job.pushed += 1
+                self._push(prio, job.video_id, win)
+            last = job.remaining == 0 and not ingesting
+        if last:
+            self._finish(job)
+        return ingesting
+
+    def _ingest_later(self, job, delay):
+        def push():
+            with self._cond:
+                # Urgent until the video has a first window to show
+                self._push((0, 0) if job.pushed == 0 else (1, self._vclock), job.video_id, _INGEST)
+        if delay:
+            threading.Timer(delay, push).start()
+        else:
+            push()
+
+    def _ingest_failed(self, job, e):
+        # Transient (e.g. the state write failed): look again later. An
+        # upload that isn't a video, or one failing every time, ends the ingest
+        job.ingest_errors += 1
+        if not isinstance(e, UnsupportedMedia) and job.ingest_errors < stream_windows.INGEST_MAX_ERRORS:
+            log.warning("ingest of %s failed (%d in a row): %s", job.video_id, job.ingest_errors, e)
+            self._ingest_later(job, stream_windows.INGEST_POLL_SECONDS)
+            return
+        log.error("ingest of %s given up", job.video_id, exc_info=e)
+        job.error = str(e)
+        self._planned(job, [], False)
+
+    def _first_done(self, job):
+        with self._cond:
+            if job.first_done_at is None:
+                job.first_done_at = time.monotonic()
+                self._ttfw.append(job.first_done_at - job.submitted_at)
+
+    def _window_finished(self, job):
+        with self._cond:
+            job.remaining -= 1
+            last = job.remaining == 0 and not job.ingesting
+        if last:
+            self._finish(job)
+
+    def _finish(self, job):
+        resume = False
+        try:
+            if job.remaining is not None or job.error is not None:
+                resume = stream_windows.finish(job.video_id, cancelled=job.cancelled or job.token.cancelled,
+                                               error=job.error)
+        finally:
+            with self._cond:
+                self._videos.pop(job.video_id, None)
+            state.close(job.video_id)
+            procs.release(job.video_id)
+            if resume:
+                # A stalled upload was completed after all: ingest the rest,
+                # still as the same job for on_done
+                self.submit(job.video_id, job.master_path, on_done=job.on_done, ingest=True)
+            elif job.on_done:
+                job.on_done(job.video_id)